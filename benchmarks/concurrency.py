@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of encodeSignedData and decodeSignedData by worker count,
+from thread pools and process pools.
+
+    python benchmarks/concurrency.py --workers 1 2 4 8 --jobs 400
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import (
+    encodeSignedData,
+    decodeSignedData,
+    signPayload,
+    orderSecret,
+    SignatureError,
+    )
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+
+def encodeJob(i):
+    return encodeSignedData(merchantkey,
+        Ds_Merchant_MerchantCode = '123456789',
+        Ds_Merchant_Order = '{:012d}'.format(i),
+        Ds_Merchant_Amount = '10000',
+        Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+        Ds_Merchant_Terminal = '1',
+        Ds_Merchant_TransactionType = '0',
+        )
+
+def notification(i):
+    order = '{:012d}'.format(i)
+    parameters = base64.urlsafe_b64encode(json.dumps(dict(
+        Ds_Order = order,
+        Ds_Response = '0000',
+        )))
+    # one out of two badly signed
+    signature = signPayload(
+        orderSecret(merchantkey, '{:012d}'.format(i + i % 2)),
+        parameters, urlsafe=True)
+    return parameters, signature, 'HMAC_SHA256_V1'
+
+notifications = {}
+
+def decodeJob(i):
+    try:
+        return decodeSignedData(merchantkey, *notifications[i])
+    except SignatureError:
+        return None
+
+def throughput(pool, job, jobs):
+    start = time.time()
+    pool.map(job, range(jobs), chunksize=4)
+    return jobs / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--jobs', type=int, default=400)
+    options = parser.parse_args()
+
+    # Precomputed so that process workers inherit them
+    notifications.update((i, notification(i)) for i in range(options.jobs))
+
+    print("cpus: {}".format(multiprocessing.cpu_count()))
+    print("{:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        'workers', 'enc threads', 'enc procs', 'dec threads', 'dec procs'))
+    for workers in options.workers:
+        results = []
+        for job in encodeJob, decodeJob:
+            for poolClass in ThreadPool, multiprocessing.Pool:
+                pool = poolClass(workers)
+                try:
+                    results.append(throughput(pool, job, options.jobs))
+                finally:
+                    pool.close()
+                    pool.join()
+        print("{:>8} {:>10.1f}/s {:>10.1f}/s {:>10.1f}/s {:>10.1f}/s".format(
+            workers, *results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Worst case decodeSignedData time by input size, over random valid
+and corrupted notifications, to spot pathological slow paths.
+Sizes go up to MAX_PAYLOAD_SIZE, larger ones are rejected upfront.
+Inputs not decoding or failing as their kind expects are reported
+as unexpected, and make the script fail.
+sermepa/fuzz_test.py checks the behaviour of the same kind of inputs.
+
+    python benchmarks/decode_worstcase.py --samples 50
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import (
+    decodeSignedData,
+    orderSecret,
+    signPayload,
+    SignatureError,
+    PayloadTooLargeError,
+    MalformedPayloadError,
+    MAX_PAYLOAD_SIZE,
+    _notification_fields,
+    )
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+version = 'HMAC_SHA256_V1'
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Characters kept as they are by json, so that sizes are exact
+_plain = string.ascii_letters + string.digits + ' .,:;-_'
+
+def notification(rng, size):
+    "A valid notification whose parameters are at most size bytes long"
+    order = ''.join(rng.choice(string.digits) for i in range(12))
+    data = dict(
+        (field, ''.join(rng.choice(_plain) for i in range(8)))
+        for field in rng.sample(_notification_fields, 8))
+    data['Ds_Order'] = order
+    data['Ds_MerchantData'] = ''
+    padding = max(0, size * 3 // 4 - len(json.dumps(data)))
+    data['Ds_MerchantData'] = ''.join(
+        rng.choice(_plain) for i in range(padding))
+    parameters = base64.urlsafe_b64encode(json.dumps(data))
+    assert len(parameters) <= size, (len(parameters), size)
+    signature = signPayload(orderSecret(merchantkey, order),
+        parameters, urlsafe=True)
+    return parameters, signature
+
+def corrupt(rng, text, alphabet):
+    "Replaces a character of text by a different one from alphabet"
+    position = rng.randrange(len(text))
+    replacement = rng.choice(alphabet.replace(text[position], ''))
+    return text[:position] + replacement + text[position+1:]
+
+def expected(kind, error):
+    "Whether the outcome, an exception or None, is the one of the kind"
+    if kind == 'valid':
+        return error is None
+    if error is None or isinstance(error, PayloadTooLargeError):
+        return False
+    if kind == 'junk chars':
+        return isinstance(error, MalformedPayloadError)
+    return True
+
+def variants(rng, size):
+    parameters, signature = notification(rng, size)
+    base64chars = string.ascii_letters + string.digits + '-_'
+    return [
+        ('valid', parameters, signature),
+        ('bad signature', parameters, corrupt(rng, signature, base64chars)),
+        ('bad payload', corrupt(rng, parameters, base64chars), signature),
+        ('junk chars', corrupt(rng, parameters, '!*\x00\xff{ '), signature),
+        ('truncated', parameters[:rng.randrange(len(parameters))], signature),
+        ('random', ''.join(rng.choice(string.printable)
+            for i in range(len(parameters))), signature),
+        ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--samples', type=int, default=50,
+        help="Random inputs of each kind and size")
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    sizes = [2**k for k in range(9, 16) if 2**k <= MAX_PAYLOAD_SIZE]
+    print("max payload size: {}".format(MAX_PAYLOAD_SIZE))
+    print("{:>7} {:<14} {:>12} {:>12} {:>10}".format(
+        'size', 'kind', 'median us', 'worst us', 'unexpected'))
+    failed = False
+    for size in sizes:
+        timings = {}
+        unexpected = {}
+        for sample in range(options.samples):
+            for kind, parameters, signature in variants(rng, size):
+                error = None
+                start = _timer()
+                try:
+                    decodeSignedData(merchantkey, parameters, signature, version,
+                        maxPayloadSize=MAX_PAYLOAD_SIZE)
+                except SignatureError as e:
+                    error = e
+                timings.setdefault(kind, []).append((_timer() - start) * 1e6)
+                unexpected[kind] = unexpected.get(kind, 0) + (
+                    not expected(kind, error))
+        for kind in sorted(timings):
+            times = sorted(timings[kind])
+            print("{:>7} {:<14} {:>12.1f} {:>12.1f} {:>10}".format(
+                size, kind, times[len(times)//2], times[-1], unexpected[kind]))
+            failed = failed or unexpected[kind]
+    if failed:
+        sys.exit("Some inputs did not decode or fail as expected")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Time spent by decodeSignedData rejecting adversarial notifications,
+compared with decoding the same payload without the early checks
+and with a full verification of a well formed but badly signed one.
+
+    python benchmarks/malformed.py --repeat 2000
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import decodeSignedData, SignatureError, _decodeParameters
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+signature = b"BskiXgq875tls56oClRVg72-ppcLpOSW0JUY9riQEKs="
+version = 'HMAC_SHA256_V1'
+
+def notification(size):
+    data = dict(
+        Ds_Order = '201649455b6f',
+        Ds_MerchantData = 'x' * size,
+        )
+    return base64.urlsafe_b64encode(json.dumps(data))
+
+cases = [
+    ('bad version', notification(100), signature, 'HMAC_SHA256_V0'),
+    ('too large 1MB', notification(1024*1024), signature, version),
+    ('bad alphabet 12KB', notification(9*1024)[:-4] + b'!!!!', signature, version),
+    ('bad padding 12KB', notification(9*1024)[:-1], signature, version),
+    ('short signature', notification(100), signature[:-4], version),
+    ('bad signature', notification(100), signature, version),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=2000)
+    options = parser.parse_args()
+
+    for name, parameters, sign, ver in cases:
+        def reject():
+            try:
+                decodeSignedData(merchantkey, parameters, sign, ver)
+            except SignatureError:
+                pass
+            else:
+                raise AssertionError("Not rejected")
+
+        def decodeOnly():
+            try:
+                _decodeParameters(parameters)
+            except SignatureError:
+                pass
+
+        rejecting = min(timeit.repeat(reject, number=options.repeat, repeat=3))
+        decoding = min(timeit.repeat(decodeOnly, number=options.repeat, repeat=3))
+        print("{:<18} rejected in {:9.2f} us   plain decoding {:9.2f} us".format(
+            name,
+            rejecting / options.repeat * 1e6,
+            decoding / options.repeat * 1e6,
+            ))
+
+if __name__ == '__main__':
+    main()
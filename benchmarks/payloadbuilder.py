@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Compares the serialization of the merchant parameters by
+encodeSignedData with a PayloadBuilder holding the merchant fields.
+Signing, the same for both, is timed apart.
+
+    python benchmarks/payloadbuilder.py --repeat 20000
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import PayloadBuilder, encodeSignedData, _checkParams
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+
+merchant = dict(
+    Ds_Merchant_MerchantCode = '123456789',
+    Ds_Merchant_MerchantName = 'the_merchant_name',
+    Ds_Merchant_MerchantURL = 'https://example.com/payment/notification',
+    Ds_Merchant_UrlOK = 'https://example.com/payment/success',
+    Ds_Merchant_UrlKO = 'https://example.com/payment/failure',
+    Ds_Merchant_Terminal = '1',
+    Ds_Merchant_TransactionType = '0',
+    Ds_Merchant_Currency = '978',
+    Ds_Merchant_ConsumerLanguage = '001',
+    Ds_Merchant_MerchantData = 'COBRAMENT QUOTA SOCI',
+    )
+
+order = dict(
+    Ds_Merchant_Order = '1447961844',
+    Ds_Merchant_Amount = '10000',
+    Ds_Merchant_SumTotal = '10000',
+    Ds_Merchant_ProductDescription = 'the_name_of_the_product',
+    Ds_Merchant_Titular = 'the_owner_of_the_account',
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20000)
+    options = parser.parse_args()
+
+    builder = PayloadBuilder(merchantkey, **merchant)
+    assert (builder.encode(**order) ==
+        encodeSignedData(merchantkey, **dict(merchant, **order)))
+
+    def withEncodeSignedData():
+        # What encodeSignedData does before signing
+        kwds = _checkParams(dict(merchant, **order))
+        base64.b64encode(json.dumps(kwds, sort_keys=True))
+
+    def withBuilder():
+        builder.encodeParameters(**order)
+
+    def signing():
+        encodeSignedData(merchantkey, **dict(merchant, **order))
+
+    for name, function, number in [
+            ('encodeSignedData', withEncodeSignedData, options.repeat),
+            ('PayloadBuilder', withBuilder, options.repeat),
+            ('whole encode', signing, options.repeat // 100 or 1),
+            ]:
+        elapsed = min(timeit.repeat(function, number=number, repeat=3))
+        print("{:<18} {:8.2f} us/order".format(name, elapsed / number * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Overhead of the Profiler by sample rate. Uses the cheapest path,
+a notification rejected by its version, so that the overhead shows.
+
+    python benchmarks/profiling.py --repeat 100000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import decodeSignedData, SignatureError
+from sermepa.profiling import Profiler
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+notification = (
+    b'eyJEc19PcmRlciI6ICI2NjYifQ==',
+    b"BskiXgq875tls56oClRVg72-ppcLpOSW0JUY9riQEKs=",
+    'bad',
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=100000)
+    options = parser.parse_args()
+
+    def timed(decode):
+        def call():
+            try:
+                decode(merchantkey, *notification)
+            except SignatureError:
+                pass
+        elapsed = min(timeit.repeat(call, number=options.repeat, repeat=3))
+        return elapsed / options.repeat * 1e6
+
+    direct = timed(decodeSignedData)
+    print("{:<14} {:8.3f} us/call".format('direct', direct))
+    for rate in 0, 0.01, 1:
+        profiled = timed(Profiler(sampleRate=rate).decodeSignedData)
+        print("{:<14} {:8.3f} us/call  overhead {:6.3f} us".format(
+            'rate {}'.format(rate), profiled, profiled - direct))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Bulk signing throughput of recurring payment schedules:
+signing every charge with encodeSignedData against streaming
+them with signSchedules.
+
+    python benchmarks/recurring.py --schedules 200 --months 12
+"""
+
+import argparse
+import datetime
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import PayloadBuilder, encodeSignedData
+from sermepa.recurring import RecurringSchedule, scheduleRequests, signSchedules
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+merchant = dict(
+    Ds_Merchant_MerchantCode = '123456789',
+    Ds_Merchant_MerchantURL = 'https://example.com/payment/notification',
+    Ds_Merchant_Terminal = '1',
+    Ds_Merchant_Currency = '978',
+    )
+
+def schedules(count, months):
+    start = datetime.date(2016,1,1)
+    for i in range(count):
+        first = start + datetime.timedelta(days=i % 30)
+        yield RecurringSchedule(
+            order = '{:012d}'.format(i),
+            amount = 1000 + i,
+            start = first,
+            frequency = 30,
+            expiry = first + datetime.timedelta(days=30 * (months - 1)),
+            )
+
+def report(name, charges, elapsed):
+    print("{:<18} {:8d} charges {:10.1f} charges/s".format(
+        name, charges, charges / elapsed))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schedules', type=int, default=200)
+    parser.add_argument('--months', type=int, default=12)
+    options = parser.parse_args()
+
+    start = time.time()
+    charges = 0
+    for date, order, params in scheduleRequests(
+            schedules(options.schedules, options.months)):
+        encodeSignedData(merchantkey, **dict(merchant, **params))
+        charges += 1
+    report('encodeSignedData', charges, time.time() - start)
+
+    builder = PayloadBuilder(merchantkey, **merchant)
+    start = time.time()
+    charges = 0
+    for date, order, formdata in signSchedules(builder,
+            schedules(options.schedules, options.months)):
+        charges += 1
+    report('signSchedules', charges, time.time() - start)
+
+    print("max rss {} KB".format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+if __name__ == '__main__':
+    main()
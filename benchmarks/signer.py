@@ -0,0 +1,53 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Compares signPayload with a reused PayloadSigner
+when several payloads are signed with the same order secret.
+
+    python benchmarks/signer.py --payloads 4 --repeat 20000
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import signPayload, PayloadSigner
+
+secret = b'38t5Zm5RjlVHNycd8Nutcg=='
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--payloads', type=int, default=4,
+        help="Payloads signed with the same secret")
+    parser.add_argument('--size', type=int, default=600,
+        help="Payload size in bytes")
+    parser.add_argument('--repeat', type=int, default=20000)
+    options = parser.parse_args()
+
+    payloads = [
+        (b'%d' % i) + b'x' * options.size
+        for i in range(options.payloads)]
+
+    def withFunction():
+        for payload in payloads:
+            signPayload(secret, payload)
+
+    def withSigner():
+        signer = PayloadSigner(secret)
+        for payload in payloads:
+            signer.sign(payload)
+
+    for name, function in [
+            ('signPayload', withFunction),
+            ('PayloadSigner', withSigner),
+            ]:
+        elapsed = min(timeit.repeat(function, number=options.repeat, repeat=3))
+        print("{:<14} {:8.2f} us/payload".format(name,
+            elapsed / options.repeat / options.payloads * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Load test comparing in-process encodeSignedData calls
+with calls to a SigningServer, from several threads.
+
+    python benchmarks/signingservice.py --threads 8 --requests 2000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sermepa import encodeSignedData
+from sermepa.signingservice import SigningServer, SigningClient
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+
+def orderData(i):
+    return dict(
+        Ds_Merchant_MerchantCode = '123456789',
+        Ds_Merchant_Order = '{:012d}'.format(i),
+        Ds_Merchant_Amount = '10000',
+        Ds_Merchant_ProductDescription = 'the_name_of_the_product',
+        Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+        Ds_Merchant_Terminal = '1',
+        Ds_Merchant_TransactionType = '0',
+        )
+
+def run(sign, nthreads, nrequests):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(first):
+        mine = []
+        for i in range(first, nrequests, nthreads):
+            start = time.time()
+            sign(**orderData(i))
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [
+        threading.Thread(target=worker, args=(i,))
+        for i in range(nthreads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies)-1, int(len(latencies)*p))]*1000
+    return dict(
+        throughput = nrequests / elapsed,
+        p50 = percentile(.50),
+        p99 = percentile(.99),
+        )
+
+def report(name, result):
+    print("{:<12} {throughput:10.1f} req/s  p50 {p50:7.2f} ms  p99 {p99:7.2f} ms"
+        .format(name, **result))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--processes', type=int, default=None)
+    options = parser.parse_args()
+
+    report('in-process', run(
+        lambda **kwds: encodeSignedData(merchantkey, **kwds),
+        options.threads, options.requests))
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'sermepa.sock')
+    server = SigningServer(path, dict(bench=merchantkey), options.processes)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        client = SigningClient(path)
+        report('service', run(
+            lambda **kwds: client.encodeSignedData('bench', **kwds),
+            options.threads, options.requests))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,11 @@
 
 import hashlib
 import base64
+import binascii
+import heapq
 import hmac
 import json
+import re
 import pyDes
 
 # Python 3 compatibility
@@ -19,6 +22,10 @@ try:
     xrange
 except NameError:
     xrange = range
+try:
+    unicode
+except NameError:
+    unicode = str
 
 # M/O Mandatory/Optional
 # N: Numeric, A: Alphanumeric, D: ISO date, M: Money in cents
@@ -220,35 +227,168 @@ def signPayload(secret, data, urlsafe=False):
     encoder = base64.urlsafe_b64encode if urlsafe else base64.b64encode
     return encoder(result)
 
+class PayloadSigner(object):
+    """
+    Signs several payloads with the same order specific secret key,
+    as signPayload does, but decoding the key and computing
+    the HMAC inner and outer pads just once.
+    Expects the order key in base64 format.
+    """
+
+    def __init__(self, secret):
+        self._hmac = hmac.new(
+            base64.b64decode(secret),
+            digestmod = hashlib.sha256
+            )
+
+    @classmethod
+    def forOrder(cls, merchantKey, order):
+        """
+        Given the merchant key and the order identifier,
+        provides a signer for the order.
+        """
+        return cls(orderSecret(merchantKey, order))
+
+    def sign(self, data, urlsafe=False):
+        """
+        Returns the signature of data in base64 format,
+        urlsafe if specified (for notification).
+        """
+        digester = self._hmac.copy()
+        digester.update(data)
+        encoder = base64.urlsafe_b64encode if urlsafe else base64.b64encode
+        return encoder(digester.digest())
+
 class SignatureError(Exception): pass
 
+# Raised by the early checks, before any crypto is done,
+# so that callers can shed junk traffic cheaply
+class UnsupportedVersionError(SignatureError): pass
+class PayloadTooLargeError(SignatureError): pass
+class MalformedPayloadError(SignatureError): pass
+class MalformedSignatureError(SignatureError): pass
+
+# Max length of the received Ds_MerchantParameters
+MAX_PAYLOAD_SIZE = 16*1024
+
+_base64Alphabet = (
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/-_')
+# 32 bytes of HMAC-SHA256 in base64, standard or urlsafe
+_signaturePattern = re.compile(b'^[A-Za-z0-9+/_-]{43}=$')
+
+def _tobytes(data):
+    if hasattr(data, 'encode'):
+        return data.encode()
+    return data
+
+def _keyFingerprint(merchantKey):
+    "Identifies a merchant key in cache keys without revealing it"
+    return hashlib.sha256(_tobytes(merchantKey)).hexdigest()[:16]
+
+def _asciiBytes(data):
+    """
+    Returns data as bytes, or None if it is neither bytes nor ascii text.
+    """
+    if isinstance(data, bytes):
+        return data
+    if not isinstance(data, unicode):
+        return None
+    try:
+        return _tobytes(data)
+    except UnicodeError:
+        return None
+
+def prevalidateSignedData(
+        Ds_MerchantParameters,
+        Ds_Signature,
+        Ds_SignatureVersion,
+        maxPayloadSize=None,
+        ):
+    """
+    Cheap checks on a received notification, previous to decoding
+    and verifying it: supported version, payload size and
+    base64 alphabet, and signature format.
+    Raises the proper SignatureError subclass if they fail.
+    """
+    if Ds_SignatureVersion != 'HMAC_SHA256_V1':
+        raise UnsupportedVersionError('Unsupported signature version')
+
+    if maxPayloadSize is None:
+        maxPayloadSize = MAX_PAYLOAD_SIZE
+    if not isinstance(Ds_MerchantParameters, (bytes, unicode)):
+        raise MalformedPayloadError('Unable to decode base 64')
+    if len(Ds_MerchantParameters) > maxPayloadSize:
+        raise PayloadTooLargeError('Payload too large')
+
+    signature = _asciiBytes(Ds_Signature)
+    if signature is None or not _signaturePattern.match(signature):
+        raise MalformedSignatureError('Malformed signature')
+
+    if len(Ds_MerchantParameters) % 4:
+        raise MalformedPayloadError('Unable to decode base 64')
+    payload = _asciiBytes(Ds_MerchantParameters)
+    if payload is None:
+        raise MalformedPayloadError('Unable to decode base 64')
+    unpadded = payload.rstrip(b'=')
+    # translate removes the alphabet at C speed, a regex is way slower
+    if len(payload) - len(unpadded) > 2 or unpadded.translate(None, _base64Alphabet):
+        raise MalformedPayloadError('Unable to decode base 64')
+
+def _decodeParameters(Ds_MerchantParameters):
+    """
+    Decodes the base64 json of the notification parameters
+    without checking the signature.
+    """
+    try:
+        json_data = base64.urlsafe_b64decode(_tobytes(Ds_MerchantParameters))
+    except (TypeError, ValueError, binascii.Error):
+        raise MalformedPayloadError('Unable to decode base 64')
+
+    try:
+        data = json.loads(json_data)
+    except ValueError:
+        raise MalformedPayloadError('Bad JSON format')
+
+    if not isinstance(data, dict):
+        raise MalformedPayloadError('Bad JSON format')
+    return data
+
+def _normalizeNotification(data):
+    """
+    Turns upper case notification parameters into camel case ones.
+    """
+    # Iterating a copy, since keys are replaced
+    for key in list(data):
+        if key in _notification_fields_upper:
+            camell = _notification_fields_upper[key]
+            data[camell]=data[key]
+            del data[key]
+            continue
+
+        if key not in _notification_fields:
+            raise SignatureError(u"Bad parameter '{}'".format(key))
+
+    return data
+
 def decodeSignedData(
         merchantKey,
         Ds_MerchantParameters,
         Ds_Signature,
         Ds_SignatureVersion,
+        maxPayloadSize=None,
         ):
 
     def error(message):
         raise SignatureError(message)
 
-    if Ds_SignatureVersion != 'HMAC_SHA256_V1':
-        error('Unsupported signature version')
-
-    def tobytes(data):
-        if hasattr(data, 'encode'):
-            return data.encode()
-        return data
-
-    try:
-        json_data = base64.urlsafe_b64decode(tobytes(Ds_MerchantParameters))
-    except:
-        error('Unable to decode base 64')
+    prevalidateSignedData(
+        Ds_MerchantParameters,
+        Ds_Signature,
+        Ds_SignatureVersion,
+        maxPayloadSize,
+        )
 
-    try:
-        data = json.loads(json_data)
-    except ValueError:
-        error('Bad JSON format')
+    data = _decodeParameters(Ds_MerchantParameters)
 
     try:
         orderid = data['Ds_Order']
@@ -256,7 +396,10 @@ def decodeSignedData(
         try:
             orderid = data['DS_ORDER']
         except KeyError:
-            error('Missing Ds_Order attribute')
+            raise MalformedPayloadError('Missing Ds_Order attribute')
+
+    if not isinstance(orderid, (bytes, unicode)):
+        raise MalformedPayloadError('Bad Ds_Order attribute')
 
     orderkey = orderSecret(merchantKey, orderid.encode('utf-8'))
     signature = signPayload(orderkey, Ds_MerchantParameters, urlsafe = True)
@@ -264,19 +407,9 @@ def decodeSignedData(
     if signature != Ds_Signature:
         error("Bad signature")
 
-    for key in data :
-        if key in _notification_fields_upper:
-            camell = _notification_fields_upper[key]
-            data[camell]=data[key]
-            del data[key]
-            continue
-
-        if key not in _notification_fields:
-            error("Bad parameter '{}'".format(key))
-
-    return data
+    return _normalizeNotification(data)
 
-def encodeSignedData(merchantKey, **kwds):
+def _checkParams(kwds):
     for param in kwds:
         if param not in DATA:
             raise ValueError(
@@ -284,6 +417,10 @@ def encodeSignedData(merchantKey, **kwds):
                 % param)
         lenght = params[param]['length']
         kwds[param] = kwds[param][:lenght]
+    return kwds
+
+def encodeSignedData(merchantKey, **kwds):
+    _checkParams(kwds)
 
     params_json = json.dumps(kwds, sort_keys=True)
     b64params = base64.b64encode(params_json)
@@ -295,19 +432,87 @@ def encodeSignedData(merchantKey, **kwds):
         Ds_Signature = signature,
         Ds_MerchantParameters = b64params,
         )
-    
+
+# '"name": ' json prefix of every member, as json.dumps sort_keys does
+_jsonKeys = dict(
+    (name, json.dumps(name) + ': ')
+    for name in DATA
+    )
+
+def _jsonMembers(kwds):
+    return sorted(
+        (param, _jsonKeys[param] + json.dumps(value))
+        for param, value in _checkParams(kwds).items()
+        )
+
+class PayloadBuilder(object):
+    """
+    Encodes and signs many orders as encodeSignedData does,
+    with the very same output, but serializing the merchant level
+    parameters, given on construction, just once.
+    Per order parameters are serialized and merged in sorted order
+    with the merchant ones, then the whole is base64 encoded at once.
+    """
+
+    def __init__(self, merchantKey, **kwds):
+        self.merchantKey = merchantKey
+        self._static = _checkParams(kwds)
+        self._members = _jsonMembers(self._static)
+
+    def encodeParameters(self, **kwds):
+        """
+        Returns the Ds_MerchantParameters for the order parameters.
+        """
+        return self._encodeParameters(kwds)
+
+    def _encodeParameters(self, kwds):
+        # Truncates kwds in place, as encodeSignedData does
+        for param in kwds:
+            if param in self._static:
+                raise ValueError(
+                    u"The parameter %s is already set for the merchant."
+                    % param)
+        members = heapq.merge(self._members, _jsonMembers(kwds))
+        params_json = '{' + ', '.join(member for param, member in members) + '}'
+        return base64.b64encode(params_json)
+
+    def encode(self, **kwds):
+        """
+        Returns the signed form data for the order parameters.
+        """
+        b64params = self._encodeParameters(kwds)
+        # The order as truncated in the parameters, as Redsys will read it
+        order = kwds.get('Ds_Merchant_Order', self._static.get('Ds_Merchant_Order'))
+        if order is None:
+            raise KeyError('Ds_Merchant_Order')
+        secret = orderSecret(self.merchantKey, order)
+        signature = signPayload(secret, b64params)
+
+        return dict(
+            Ds_SignatureVersion = 'HMAC_SHA256_V1',
+            Ds_Signature = signature,
+            Ds_MerchantParameters = b64params,
+            )
 
 
 class Client(object):
-    """Client"""
+    """Client
+
+    An optional `cache`, any store from `sermepa.cache`,
+    keeps the signed form data so that rendering again the form
+    for the very same parameters does not redo the signature.
+    Cache keys hold just digests, never the private key.
+    """
 
     def __init__(self, business_code, priv_key,
-                 endpoint_url='https://sis.redsys.es/sis/realizarPago'):
+                 endpoint_url='https://sis.redsys.es/sis/realizarPago',
+                 cache=None):
         # init params
         for param in DATA:
             setattr(self, param, None)
         self.endpoint = endpoint_url
         self.priv_key = priv_key
+        self.cache = cache
         self.Ds_Merchant_MerchantCode = business_code
 
     def get_pay_form_data(self, transaction_params):
@@ -316,33 +521,60 @@ class Client(object):
             if param not in DATA:
                 raise ValueError(u"The received parameter %s is not allowed."
                                  % param)
-            setattr(self, param, transaction_params[param])
 
-        return encodeSignedData(self.priv_key, **{
-            'Ds_Merchant_Amount': str(int(self.Ds_Merchant_Amount * 100)),
-            'Ds_Merchant_Currency': self.Ds_Merchant_Currency or '978', # EUR
-            'Ds_Merchant_Order': self.Ds_Merchant_Order[:12],
+        # Parameters of a call are not stored in self, so that
+        # concurrent calls on a shared client do not mix them.
+        # Attributes set on the client act as defaults.
+        values = dict((param, getattr(self, param)) for param in DATA)
+        values.update(transaction_params)
+
+        parameters = {
+            'Ds_Merchant_Amount': str(int(values['Ds_Merchant_Amount'] * 100)),
+            'Ds_Merchant_Currency': values['Ds_Merchant_Currency'] or '978', # EUR
+            'Ds_Merchant_Order': values['Ds_Merchant_Order'][:12],
             'Ds_Merchant_ProductDescription':
-                self.Ds_Merchant_ProductDescription[:125],
-            'Ds_Merchant_Titular': self.Ds_Merchant_Titular[:60],
-            'Ds_Merchant_MerchantCode': self.Ds_Merchant_MerchantCode[:9],
-            'Ds_Merchant_MerchantURL': self.Ds_Merchant_MerchantURL[:250],
-            'Ds_Merchant_UrlOK': self.Ds_Merchant_UrlOK[:250],
-            'Ds_Merchant_UrlKO': self.Ds_Merchant_UrlKO[:250],
-            'Ds_Merchant_MerchantName': self.Ds_Merchant_MerchantName[:25],
-            'Ds_Merchant_ConsumerLanguage': self.Ds_Merchant_ConsumerLanguage,
-            'Ds_Merchant_Terminal': self.Ds_Merchant_Terminal or '1',
-            'Ds_Merchant_SumTotal': str(int(self.Ds_Merchant_SumTotal * 100)),
-            'Ds_Merchant_TransactionType': self.Ds_Merchant_TransactionType \
-                or '0',
-            'Ds_Merchant_MerchantData': self.Ds_Merchant_MerchantData[:1024],
-#            'Ds_Merchant_DateFrecuency': self.Ds_Merchant_DateFrecuency,
-#            'Ds_Merchant_ChargeExpiryDate':
-#                (self.Ds_Merchant_ChargeExpiryDate and
-#                 self.Ds_Merchant_ChargeExpiryDate[:10] or None),
-#            'Ds_Merchant_AuthorisationCode': self.Ds_Merchant_AuthorisationCode,
-#            'Ds_Merchant_TransactionDate': self.Ds_Merchant_TransactionDate,
-            })
+                values['Ds_Merchant_ProductDescription'][:125],
+            'Ds_Merchant_Titular': values['Ds_Merchant_Titular'][:60],
+            'Ds_Merchant_MerchantCode': values['Ds_Merchant_MerchantCode'][:9],
+            'Ds_Merchant_MerchantURL': values['Ds_Merchant_MerchantURL'][:250],
+            'Ds_Merchant_UrlOK': values['Ds_Merchant_UrlOK'][:250],
+            'Ds_Merchant_UrlKO': values['Ds_Merchant_UrlKO'][:250],
+            'Ds_Merchant_MerchantName': values['Ds_Merchant_MerchantName'][:25],
+            'Ds_Merchant_ConsumerLanguage':
+                values['Ds_Merchant_ConsumerLanguage'],
+            'Ds_Merchant_Terminal': values['Ds_Merchant_Terminal'] or '1',
+            'Ds_Merchant_SumTotal': str(int(values['Ds_Merchant_SumTotal'] * 100)),
+            'Ds_Merchant_TransactionType':
+                values['Ds_Merchant_TransactionType'] or '0',
+            'Ds_Merchant_MerchantData': values['Ds_Merchant_MerchantData'][:1024],
+            }
+        # Just for recurring transactions, see sermepa.recurring.
+        # Taken from this call alone, never from a previous one.
+        for param in [
+                'Ds_Merchant_DateFrecuency',
+                'Ds_Merchant_ChargeExpiryDate',
+                'Ds_Merchant_AuthorisationCode',
+                'Ds_Merchant_TransactionDate',
+                ]:
+            if transaction_params.get(param) is not None:
+                parameters[param] = transaction_params[param]
+
+        if self.cache is None:
+            return encodeSignedData(self.priv_key, **parameters)
+
+        # Any change in the parameters or the key gives a new entry
+        key = (
+            _keyFingerprint(self.priv_key),
+            hashlib.sha256(json.dumps(parameters, sort_keys=True)).hexdigest(),
+            )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(
+                (str(name), str(value))
+                for name, value in json.loads(cached).items())
+        formdata = encodeSignedData(self.priv_key, **parameters)
+        self.cache.set(key, json.dumps(formdata))
+        return formdata
 
 
 class TestClient(Client):
@@ -354,7 +586,7 @@ class TestClient(Client):
     CIP: 123456
     """
 
-    def __init__(self, business_code, priv_key):
+    def __init__(self, business_code, priv_key, cache=None):
         super(TestClient, self).__init__(business_code, priv_key,
-              'https://sis-t.redsys.es:25443/sis/realizarPago')
+              'https://sis-t.redsys.es:25443/sis/realizarPago', cache)
 
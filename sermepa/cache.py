@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Sermepa caches
+    ~~~~~~~~~~~~~~
+
+    Bounded key-value stores with expiration, used to avoid
+    redoing the signing work for repeated requests.
+
+    Every store provides `get(key)`, returning None when the key
+    is missing or expired, and `set(key, value)`.
+    Keys are tuples of strings, values are strings,
+    but the in-memory LRUCache accepts any hashable key and any value.
+
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    In-memory store which evicts the least recently used entry
+    when it holds more than `maxsize` entries and forgets entries
+    older than `ttl` seconds. A `ttl` of None means no expiration.
+    Safe to share among threads.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires is not None and expires <= self.clock():
+                return None
+            self._entries[key] = expires, value
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = expires, value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteCache(object):
+    """
+    Store kept in a SQLite file so that it can be shared
+    among several worker processes.
+    Entries older than `ttl` seconds are ignored and
+    purged on insertion. A `ttl` of None means no expiration.
+    """
+
+    def __init__(self, path, ttl=None, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sermepa_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires REAL"
+            ")")
+        # Purging on every insertion must not scan the whole table
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS sermepa_cache_expires"
+            " ON sermepa_cache (expires)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared among threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def _key(self, key):
+        return json.dumps(list(key))
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sermepa_cache").fetchone()[0]
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires FROM sermepa_cache WHERE key = ?",
+            (self._key(key),)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires <= self.clock():
+            return None
+        return value
+
+    def set(self, key, value):
+        now = self.clock()
+        expires = None if self.ttl is None else now + self.ttl
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO sermepa_cache (key, value, expires)"
+            " VALUES (?, ?, ?)",
+            (self._key(key), value, expires))
+        connection.execute(
+            "DELETE FROM sermepa_cache WHERE expires <= ?", (now,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM sermepa_cache")
@@ -0,0 +1,253 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Stress tests calling the entry points concurrently, from thread and
+process pools, with mixed valid and invalid payloads.
+Results must be the same than calling them serially.
+"""
+
+import unittest
+
+import base64
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from sermepa import (
+    encodeSignedData,
+    decodeSignedData,
+    signPayload,
+    orderSecret,
+    SignatureError,
+    Client,
+    PayloadBuilder,
+    )
+from sermepa.cache import LRUCache
+from sermepa.dedup import NotificationDeduplicator
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+merchant = dict(
+    Ds_Merchant_MerchantCode = '123456789',
+    Ds_Merchant_MerchantName = 'the_merchant_name',
+    Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+    Ds_Merchant_Terminal = '1',
+    Ds_Merchant_TransactionType = '0',
+    )
+njobs = 60
+
+
+def orderData(i):
+    data = dict(
+        Ds_Merchant_Order = '{:012d}'.format(i),
+        Ds_Merchant_Amount = str(100 + i),
+        Ds_Merchant_ProductDescription = 'product {}'.format(i),
+        )
+    if i % 5 == 4:
+        data['BadData'] = 'value'
+    return data
+
+def notification(i):
+    parameters = base64.urlsafe_b64encode(json.dumps(dict(
+        Ds_Order = '{:012d}'.format(i),
+        Ds_Amount = str(100 + i),
+        Ds_Response = '0000',
+        )))
+    signature = signPayload(
+        orderSecret(merchantkey, '{:012d}'.format(i)),
+        parameters, urlsafe=True)
+    version = 'HMAC_SHA256_V1'
+    kind = i % 5
+    if kind == 1:
+        signature = signPayload(
+            orderSecret(merchantkey, '{:012d}'.format(i+1)),
+            parameters, urlsafe=True)
+    elif kind == 2:
+        version = 'bad'
+    elif kind == 3:
+        parameters = parameters[:-1]
+    elif kind == 4:
+        signature = signature[:-4]
+    return parameters, signature, version
+
+def outcome(function, *args, **kwds):
+    "Turns errors into comparable results"
+    try:
+        return 'ok', function(*args, **kwds)
+    except (SignatureError, ValueError, KeyError) as e:
+        return type(e).__name__, e.args[0]
+
+def encodeJob(i):
+    return outcome(encodeSignedData, merchantkey,
+        **dict(merchant, **orderData(i)))
+
+def decodeJob(i):
+    return outcome(decodeSignedData, merchantkey, *notification(i))
+
+
+class Concurrency_Test(unittest.TestCase):
+
+    def assertSameAsSerial(self, job, pool, inputs=None):
+        inputs = list(inputs or range(njobs))
+        expected = [job(i) for i in inputs]
+        # several rounds so that calls interleave differently
+        for round in range(2):
+            result = pool.map(job, inputs, chunksize=1)
+            self.assertEqual(result, expected)
+        return expected
+
+    def setUp(self):
+        self.pool = ThreadPool(8)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+
+    def test_mixedJobsAreMixed(self):
+        kinds = set(result[0] for result in
+            [encodeJob(i) for i in range(5)] +
+            [decodeJob(i) for i in range(5)])
+        self.assertEqual(kinds, set([
+            'ok',
+            'ValueError',
+            'SignatureError',
+            'UnsupportedVersionError',
+            'MalformedPayloadError',
+            'MalformedSignatureError',
+            ]))
+
+    def test_encodeSignedData_threads(self):
+        self.assertSameAsSerial(encodeJob, self.pool)
+
+    def test_decodeSignedData_threads(self):
+        self.assertSameAsSerial(decodeJob, self.pool)
+
+    def test_encodeSignedData_processes(self):
+        pool = multiprocessing.Pool(4)
+        try:
+            self.assertSameAsSerial(encodeJob, pool)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_decodeSignedData_processes(self):
+        pool = multiprocessing.Pool(4)
+        try:
+            self.assertSameAsSerial(decodeJob, pool)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_sharedClient_threads(self):
+        client = Client('123456789', merchantkey)
+        def job(i):
+            return outcome(client.get_pay_form_data, dict(
+                Ds_Merchant_Order = '{:012d}'.format(i),
+                Ds_Merchant_Amount = i,
+                Ds_Merchant_SumTotal = i,
+                Ds_Merchant_ProductDescription = 'product {}'.format(i),
+                Ds_Merchant_Titular = 'owner {}'.format(i),
+                Ds_Merchant_MerchantName = 'the_merchant_name',
+                Ds_Merchant_MerchantURL = 'url {}'.format(i),
+                Ds_Merchant_UrlOK = 'ok {}'.format(i),
+                Ds_Merchant_UrlKO = 'ko {}'.format(i),
+                Ds_Merchant_MerchantData = 'data {}'.format(i),
+                Ds_Merchant_ConsumerLanguage = '001',
+                ))
+        self.assertSameAsSerial(job, self.pool)
+
+    def test_sharedClient_partialParameters_threads(self):
+        def newClient():
+            client = Client('123456789', merchantkey)
+            # Defaults for the fields calls leave out
+            client.Ds_Merchant_Titular = 'default owner'
+            client.Ds_Merchant_MerchantName = 'the_merchant_name'
+            client.Ds_Merchant_MerchantURL = 'default url'
+            client.Ds_Merchant_UrlOK = 'default ok'
+            client.Ds_Merchant_UrlKO = 'default ko'
+            client.Ds_Merchant_MerchantData = 'default data'
+            client.Ds_Merchant_ConsumerLanguage = '001'
+            return client
+        def transaction(i):
+            params = dict(
+                Ds_Merchant_Order = '{:012d}'.format(i),
+                Ds_Merchant_Amount = i,
+                Ds_Merchant_SumTotal = i,
+                Ds_Merchant_ProductDescription = 'product {}'.format(i),
+                )
+            if i % 2:
+                params.update(
+                    Ds_Merchant_Titular = 'owner {}'.format(i),
+                    Ds_Merchant_MerchantData = 'data {}'.format(i),
+                    Ds_Merchant_Terminal = '2',
+                    )
+            return params
+        client = newClient()
+        # Each call as if it was the only one
+        expected = [newClient().get_pay_form_data(transaction(i))
+            for i in range(njobs)]
+        for round in range(2):
+            result = self.pool.map(
+                lambda i: client.get_pay_form_data(transaction(i)),
+                range(njobs), chunksize=1)
+            self.assertEqual(result, expected)
+
+    def test_sharedCachedClient_threads(self):
+        client = Client('123456789', merchantkey, cache=LRUCache(maxsize=10))
+        uncached = Client('123456789', merchantkey)
+        def transaction(i):
+            return dict(
+                Ds_Merchant_Order = '{:012d}'.format(i % 15),
+                Ds_Merchant_Amount = i % 15,
+                Ds_Merchant_SumTotal = i % 15,
+                Ds_Merchant_ProductDescription = 'product',
+                Ds_Merchant_Titular = 'owner',
+                Ds_Merchant_MerchantName = 'the_merchant_name',
+                Ds_Merchant_MerchantURL = 'url',
+                Ds_Merchant_UrlOK = 'ok',
+                Ds_Merchant_UrlKO = 'ko',
+                Ds_Merchant_MerchantData = 'data',
+                Ds_Merchant_ConsumerLanguage = '001',
+                )
+        expected = [uncached.get_pay_form_data(transaction(i))
+            for i in range(njobs)]
+        result = self.pool.map(
+            lambda i: client.get_pay_form_data(transaction(i)),
+            range(njobs), chunksize=1)
+        self.assertEqual(result, expected)
+
+    def test_sharedPayloadBuilder_threads(self):
+        builder = PayloadBuilder(merchantkey, **merchant)
+        def job(i):
+            return outcome(builder.encode, **orderData(i))
+        self.assertEqual(
+            self.assertSameAsSerial(job, self.pool),
+            [encodeJob(i) for i in range(njobs)])
+
+    def test_sharedDeduplicator_threads(self):
+        dedup = NotificationDeduplicator(merchantkey, LRUCache())
+        def job(i):
+            parameters, signature, version = notification(i % 20)
+            result = outcome(dedup.decode, parameters, signature, version)
+            if result[0] != 'ok':
+                return result
+            data, duplicated = result[1]
+            if not duplicated:
+                dedup.markProcessed(parameters, signature)
+            return 'ok', data
+        expected = [decodeJob(i % 20) for i in range(njobs)]
+        result = self.pool.map(job, range(njobs), chunksize=1)
+        self.assertEqual(result, expected)
+        stats = dedup.stats()
+        # Malformed ones are rejected before being counted
+        self.assertEqual(stats['hits'] + stats['misses'], njobs * 2 // 5)
+        # 4 valid notifications, each received 3 times,
+        # concurrent first receptions may miss both
+        self.assertTrue(stats['hits'] <= 8)
+
+
+unittest.TestCase.__str__ = unittest.TestCase.id
+
+if __name__ == '__main__':
+    import sys
+    code = unittest.main()
+    sys.exit(code)
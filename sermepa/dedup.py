@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Sermepa notification deduplication
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Redsys retries the online notifications until the merchant
+    acknowledges them. The deduplicator remembers the notifications
+    already processed so that retries skip the 3DES and HMAC work
+    and can be told apart from new notifications.
+
+"""
+
+import threading
+
+from . import (
+    decodeSignedData,
+    prevalidateSignedData,
+    _decodeParameters,
+    _normalizeNotification,
+    _tobytes,
+    _keyFingerprint,
+    )
+from .cache import LRUCache
+
+_keyFields = [
+    'Ds_MerchantCode',
+    'Ds_Order',
+    'Ds_Response',
+    'Ds_Date',
+    'Ds_Hour',
+    ]
+
+
+def notificationKey(data, signature):
+    """
+    Given the decoded notification parameters and its signature,
+    returns the key identifying the notification.
+    Parameters may use either camel or upper case names.
+    """
+    def field(name):
+        value = data.get(name, data.get(name.upper()))
+        return u'' if value is None else u'{}'.format(value)
+
+    if hasattr(signature, 'decode'):
+        signature = signature.decode('ascii')
+    return tuple(field(name) for name in _keyFields) + (signature,)
+
+
+class NotificationDeduplicator(object):
+    """
+    Wraps decodeSignedData with a store of the notifications
+    already verified and processed. Any store from `sermepa.cache` will do:
+    a LRUCache for a single process, a SqliteCache for
+    several worker processes.
+    Entries are keyed also by a fingerprint of the merchant key,
+    so a store shared by several merchants never takes a notification
+    verified with a key as verified with another.
+    """
+
+    def __init__(self, merchantKey, store, maxPayloadSize=None):
+        self.merchantKey = merchantKey
+        self._fingerprint = _keyFingerprint(merchantKey)
+        self.store = store
+        self.maxPayloadSize = maxPayloadSize
+        self._verified = LRUCache(maxsize=1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hitRate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                hits = self.hits,
+                misses = self.misses,
+                hitRate = self.hitRate,
+                )
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _key(self, data, Ds_Signature):
+        return (self._fingerprint,) + notificationKey(data, Ds_Signature)
+
+    def decode(self,
+            Ds_MerchantParameters,
+            Ds_Signature,
+            Ds_SignatureVersion,
+            ):
+        """
+        Like decodeSignedData but returns a tuple (data, duplicated),
+        duplicated being True when the very same notification
+        was already processed, in which case no crypto is done.
+        Nothing is remembered until markProcessed is called.
+        """
+        prevalidateSignedData(
+            Ds_MerchantParameters,
+            Ds_Signature,
+            Ds_SignatureVersion,
+            self.maxPayloadSize,
+            )
+        data = _decodeParameters(Ds_MerchantParameters)
+        key = self._key(data, Ds_Signature)
+        parameters = _tobytes(Ds_MerchantParameters).decode('ascii')
+
+        # The signature already matched these exact parameters,
+        # being the same, no need to check it again.
+        # Comparing them avoids replaying a known signature
+        # with tampered parameters.
+        verified = self.store.get(key)
+        if verified is not None and verified == parameters:
+            self._count(hit=True)
+            return _normalizeNotification(data), True
+
+        self._count(hit=False)
+        data = decodeSignedData(
+            self.merchantKey,
+            Ds_MerchantParameters,
+            Ds_Signature,
+            Ds_SignatureVersion,
+            self.maxPayloadSize,
+            )
+        self._verified.set(key, parameters)
+        return data, False
+
+    def markProcessed(self, Ds_MerchantParameters, Ds_Signature):
+        """
+        Remembers a notification, previously verified by decode,
+        once the caller has handled it, so that its retries
+        come as duplicated. If the handling fails, not calling it
+        lets the Redsys retries through again.
+        """
+        data = _decodeParameters(Ds_MerchantParameters)
+        key = self._key(data, Ds_Signature)
+        parameters = _tobytes(Ds_MerchantParameters).decode('ascii')
+        # Only signatures checked by this deduplicator get stored
+        if self._verified.get(key) != parameters:
+            raise ValueError(u"The notification was not verified")
+        self.store.set(key, parameters)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import base64
+import os
+import shutil
+import tempfile
+from sermepa import signPayload, SignatureError
+from sermepa.cache import LRUCache, SqliteCache
+from sermepa.dedup import NotificationDeduplicator, notificationKey
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCache_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def createCache(self, **kwds):
+        return LRUCache(clock=self.clock, **kwds)
+
+    def test_get_whenMissing(self):
+        cache = self.createCache()
+        self.assertEqual(cache.get(('a',)), None)
+
+    def test_get_whenSet(self):
+        cache = self.createCache()
+        cache.set(('a',), 'value')
+        self.assertEqual(cache.get(('a',)), 'value')
+
+    def test_get_whenExpired(self):
+        cache = self.createCache(ttl=10)
+        cache.set(('a',), 'value')
+        self.clock.now += 10
+        self.assertEqual(cache.get(('a',)), None)
+
+    def test_get_beforeExpiring(self):
+        cache = self.createCache(ttl=10)
+        cache.set(('a',), 'value')
+        self.clock.now += 9
+        self.assertEqual(cache.get(('a',)), 'value')
+
+    def test_set_evictsLeastRecentlyUsed(self):
+        cache = LRUCache(maxsize=2)
+        cache.set(('a',), 'A')
+        cache.set(('b',), 'B')
+        cache.get(('a',))
+        cache.set(('c',), 'C')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(('a',)), 'A')
+        self.assertEqual(cache.get(('b',)), None)
+        self.assertEqual(cache.get(('c',)), 'C')
+
+
+class SqliteCache_Test(LRUCache_Test):
+
+    def setUp(self):
+        super(SqliteCache_Test, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def createCache(self, maxsize=None, **kwds):
+        return SqliteCache(self.path, clock=self.clock, **kwds)
+
+    def test_set_evictsLeastRecentlyUsed(self):
+        "Not bounded by size"
+
+    def test_get_fromAnotherInstance(self):
+        self.createCache().set(('a',), 'value')
+        self.assertEqual(self.createCache().get(('a',)), 'value')
+
+    def test_expiresIndexed(self):
+        cache = self.createCache(ttl=10)
+        plan = cache._connection().execute(
+            "EXPLAIN QUERY PLAN"
+            " DELETE FROM sermepa_cache WHERE expires <= ?", (0,)).fetchall()
+        self.assertIn('sermepa_cache_expires', ' '.join(
+            row[-1] for row in plan))
+
+
+class NotificationDeduplicator_Test(unittest.TestCase):
+
+    merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+    secret = '1uGRHjGaVgg='
+    encodeddata = b'eyJEc19PcmRlciI6ICI2NjYifQ=='
+    signature = b"BskiXgq875tls56oClRVg72-ppcLpOSW0JUY9riQEKs="
+    signatureversion = 'HMAC_SHA256_V1'
+
+    def setUp(self):
+        self.dedup = NotificationDeduplicator(self.merchantkey, LRUCache())
+
+    def decode(self, parameters=None, signature=None):
+        return self.dedup.decode(
+            Ds_MerchantParameters = parameters or self.encodeddata,
+            Ds_Signature = signature or self.signature,
+            Ds_SignatureVersion = self.signatureversion,
+            )
+
+    def process(self, parameters=None, signature=None):
+        "Decodes and marks as processed"
+        result = self.decode(parameters, signature)
+        self.dedup.markProcessed(
+            parameters or self.encodeddata,
+            signature or self.signature,
+            )
+        return result
+
+    def test_notificationKey(self):
+        key = notificationKey(dict(
+            DS_MERCHANTCODE = '999008881',
+            Ds_Order = '666',
+            Ds_Response = '0000',
+            Ds_Date = '19%2F01%2F2016',
+            Ds_Hour = '22%3A04',
+            ), b'signature')
+        self.assertEqual(key, (
+            u'999008881', u'666', u'0000',
+            u'19%2F01%2F2016', u'22%3A04', u'signature'))
+
+    def test_decode_firstTime(self):
+        data, duplicated = self.decode()
+        self.assertEqual(data, dict(Ds_Order = '666'))
+        self.assertFalse(duplicated)
+        self.assertEqual(self.dedup.stats(), dict(
+            hits = 0,
+            misses = 1,
+            hitRate = 0.0,
+            ))
+
+    def test_decode_retried(self):
+        self.process()
+        data, duplicated = self.decode()
+        self.assertEqual(data, dict(Ds_Order = '666'))
+        self.assertTrue(duplicated)
+        self.assertEqual(self.dedup.stats(), dict(
+            hits = 1,
+            misses = 1,
+            hitRate = 0.5,
+            ))
+
+    def test_decode_badSignatureNotRemembered(self):
+        badSignature = b"AAAAXgq875tls56oClRVg72-ppcLpOSW0JUY9riQEKs="
+        for i in range(2):
+            with self.assertRaises(SignatureError) as cm:
+                self.decode(signature=badSignature)
+            self.assertEqual(cm.exception.args[0], 'Bad signature')
+        self.assertEqual(self.dedup.hits, 0)
+
+    def test_decode_retriedAfterFailedHandling(self):
+        self.decode()
+        # Handling failed, markProcessed not called
+        data, duplicated = self.decode()
+        self.assertEqual(data, dict(Ds_Order = '666'))
+        self.assertFalse(duplicated)
+        self.dedup.markProcessed(self.encodeddata, self.signature)
+        data, duplicated = self.decode()
+        self.assertTrue(duplicated)
+
+    def test_markProcessed_notVerified(self):
+        with self.assertRaises(ValueError):
+            self.dedup.markProcessed(self.encodeddata, self.signature)
+        data, duplicated = self.decode()
+        self.assertFalse(duplicated)
+
+    def test_markProcessed_tamperedParameters(self):
+        self.decode()
+        tampered = base64.urlsafe_b64encode('{"Ds_Order":"666"}')
+        with self.assertRaises(ValueError):
+            self.dedup.markProcessed(tampered, self.signature)
+
+    def test_decode_tamperedParametersWithKnownSignature(self):
+        self.process()
+        # Same key fields but different content
+        tampered = base64.urlsafe_b64encode('{"Ds_Order":"666"}')
+        with self.assertRaises(SignatureError) as cm:
+            self.decode(parameters=tampered)
+        self.assertEqual(cm.exception.args[0], 'Bad signature')
+
+    def test_decode_upperCaseParameters(self):
+        parameters = base64.urlsafe_b64encode('{"DS_ORDER":"666"}')
+        signature = signPayload(self.secret, parameters, urlsafe=True)
+        self.process(parameters, signature)
+        data, duplicated = self.decode(parameters, signature)
+        self.assertEqual(data, dict(Ds_Order = '666'))
+        self.assertTrue(duplicated)
+
+    def test_decode_unicodeRetry(self):
+        self.process()
+        data, duplicated = self.decode(
+            self.encodeddata.decode('ascii'),
+            self.signature.decode('ascii'),
+            )
+        self.assertTrue(duplicated)
+
+    def test_decode_orderNotAString(self):
+        parameters = base64.urlsafe_b64encode('{"Ds_Order":666}')
+        with self.assertRaises(SignatureError) as cm:
+            self.decode(parameters=parameters)
+        self.assertEqual(cm.exception.args[0], 'Bad Ds_Order attribute')
+
+    def test_decode_storeSharedByMerchants(self):
+        store = LRUCache()
+        dedup = NotificationDeduplicator(self.merchantkey, store)
+        dedup.decode(self.encodeddata, self.signature, self.signatureversion)
+        dedup.markProcessed(self.encodeddata, self.signature)
+        other = NotificationDeduplicator(b'otherkeyotherkeyotherkeyotherkey', store)
+        with self.assertRaises(SignatureError) as cm:
+            other.decode(self.encodeddata, self.signature, self.signatureversion)
+        self.assertEqual(cm.exception.args[0], 'Bad signature')
+        self.assertEqual(other.hits, 0)
+
+    def test_decode_badVersion(self):
+        with self.assertRaises(SignatureError) as cm:
+            self.dedup.decode(
+                Ds_MerchantParameters = self.encodeddata,
+                Ds_Signature = self.signature,
+                Ds_SignatureVersion = 'bad',
+                )
+        self.assertEqual(cm.exception.args[0], 'Unsupported signature version')
+
+
+unittest.TestCase.__str__ = unittest.TestCase.id
+
+if __name__ == '__main__':
+    import sys
+    code = unittest.main()
+    sys.exit(code)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+"""
+Property based tests of the signing and decoding paths.
+benchmarks/decode_worstcase.py measures the decoder time by input size.
+"""
+
+import unittest
+
+import base64
+import json
+from sermepa import (
+    orderSecret,
+    signPayload,
+    decodeSignedData,
+    encodeSignedData,
+    SignatureError,
+    PayloadBuilder,
+    params,
+    _notification_fields,
+    )
+
+try:
+    from hypothesis import given, settings, assume, strategies as st
+except ImportError:
+    given = None
+
+merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+signatureversion = 'HMAC_SHA256_V1'
+
+
+def signedNotification(data):
+    order = data.get('Ds_Order', data.get('DS_ORDER'))
+    parameters = base64.urlsafe_b64encode(json.dumps(data))
+    signature = signPayload(
+        orderSecret(merchantkey, order.encode('utf-8')),
+        parameters, urlsafe=True)
+    return parameters, signature
+
+def signedJunk(data):
+    "Signs as if the order was the json text of whatever Ds_Order has"
+    order = data.get('Ds_Order', data.get('DS_ORDER'))
+    if not isinstance(order, type(u'')):
+        order = json.dumps(order)
+    parameters = base64.urlsafe_b64encode(json.dumps(data))
+    signature = signPayload(
+        orderSecret(merchantkey, order.encode('utf-8')),
+        parameters, urlsafe=True)
+    return parameters, signature
+
+def decode(parameters, signature, version=signatureversion):
+    return decodeSignedData(
+        merchantkey,
+        Ds_MerchantParameters = parameters,
+        Ds_Signature = signature,
+        Ds_SignatureVersion = version,
+        )
+
+def camelCase(data):
+    return dict(
+        ([field for field in _notification_fields
+            if field.upper() == key.upper()][0], value)
+        for key, value in data.items())
+
+
+if given:
+
+    values = st.text(max_size=30)
+    orders = st.text(
+        alphabet = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ',
+        min_size = 4,
+        max_size = 16, # Redsys takes just 12
+        )
+
+    @st.composite
+    def notifications(draw):
+        "Notification parameters, either in camel or upper case"
+        fields = draw(st.sets(st.sampled_from(
+            [field for field in _notification_fields if field != 'Ds_Order'])))
+        data = dict(
+            (field.upper() if draw(st.booleans()) else field, draw(values))
+            for field in fields)
+        orderField = draw(st.sampled_from(['Ds_Order', 'DS_ORDER']))
+        data[orderField] = draw(orders)
+        return data
+
+    jsonValues = st.recursive(
+        st.none() | st.booleans() | st.integers() | st.text(max_size=10),
+        lambda children:
+            st.lists(children, max_size=3) |
+            st.dictionaries(st.text(max_size=10), children, max_size=3),
+        max_leaves = 6,
+        )
+
+    @st.composite
+    def junkNotifications(draw):
+        "Notification fields, Ds_Order included, holding any json value"
+        fields = draw(st.sets(st.sampled_from(_notification_fields)))
+        data = dict(
+            (field.upper() if draw(st.booleans()) else field, draw(jsonValues))
+            for field in fields)
+        orderField = draw(st.sampled_from(['Ds_Order', 'DS_ORDER']))
+        data[orderField] = draw(jsonValues)
+        return data
+
+    @st.composite
+    def requests(draw):
+        "encodeSignedData parameters, with Ds_Merchant_Order"
+        fields = draw(st.sets(st.sampled_from(
+            [name for name in params if name != 'Ds_Merchant_Order'])))
+        data = dict(
+            (field, draw(st.text(max_size=params[field]['length'] + 10)))
+            for field in fields)
+        data['Ds_Merchant_Order'] = draw(orders).encode('ascii')
+        return data
+
+    fuzzsettings = settings(max_examples=50, deadline=None)
+
+
+@unittest.skipIf(not given, "Requires hypothesis")
+class DecodeFuzz_Test(unittest.TestCase):
+
+    if given:
+
+        @fuzzsettings
+        @given(notifications())
+        def test_signThenVerify_roundTrips(self, data):
+            parameters, signature = signedNotification(data)
+            self.assertEqual(decode(parameters, signature), camelCase(data))
+
+        @fuzzsettings
+        @given(notifications())
+        def test_signThenVerify_unicodeInput(self, data):
+            parameters, signature = signedNotification(data)
+            self.assertEqual(
+                decode(parameters.decode('ascii'), signature.decode('ascii')),
+                camelCase(data))
+
+        @fuzzsettings
+        @given(notifications(), st.data())
+        def test_corruptedParameters_rejected(self, data, draw):
+            parameters, signature = signedNotification(data)
+            position = draw.draw(st.integers(0, len(parameters)-1))
+            replacement = draw.draw(st.characters(max_codepoint=0x7f))
+            corrupted = (
+                parameters[:position] + replacement.encode('ascii')
+                + parameters[position+1:])
+            try:
+                result = decode(corrupted, signature)
+            except SignatureError:
+                return
+            # Still valid just if base64 decodes to the same
+            self.assertEqual(
+                base64.urlsafe_b64decode(corrupted),
+                base64.urlsafe_b64decode(parameters))
+            self.assertEqual(result, camelCase(data))
+
+        @fuzzsettings
+        @given(notifications(), st.data())
+        def test_corruptedSignature_rejected(self, data, draw):
+            parameters, signature = signedNotification(data)
+            position = draw.draw(st.integers(0, len(signature)-1))
+            replacement = draw.draw(st.characters(max_codepoint=0x7f))
+            assume(replacement.encode('ascii') != signature[position:position+1])
+            corrupted = (
+                signature[:position] + replacement.encode('ascii')
+                + signature[position+1:])
+            with self.assertRaises(SignatureError):
+                decode(parameters, corrupted)
+
+        @fuzzsettings
+        @given(notifications(), st.integers(0, 200))
+        def test_truncatedParameters_rejected(self, data, length):
+            parameters, signature = signedNotification(data)
+            assume(length < len(parameters))
+            with self.assertRaises(SignatureError):
+                decode(parameters[:length], signature)
+
+        @fuzzsettings
+        @given(
+            st.one_of(st.binary(max_size=200), st.text(max_size=200)),
+            st.one_of(st.binary(max_size=50), st.text(max_size=50)),
+            st.one_of(st.just(signatureversion), st.text(max_size=20)),
+            )
+        def test_arbitraryInput_onlySignatureErrors(self, parameters, signature, version):
+            with self.assertRaises(SignatureError):
+                decode(parameters, signature, version)
+
+        @fuzzsettings
+        @given(junkNotifications())
+        def test_signedJunkValues_onlySignatureErrors(self, data):
+            parameters, signature = signedJunk(data)
+            try:
+                decode(parameters, signature)
+            except SignatureError:
+                pass
+
+        @fuzzsettings
+        @given(st.dictionaries(
+            st.text(max_size=20), values, max_size=5), orders)
+        def test_unknownParameters_rejected(self, data, order):
+            assume(not any(
+                key.upper() in [field.upper() for field in _notification_fields]
+                for key in data))
+            assume(data)
+            data['Ds_Order'] = order
+            parameters, signature = signedNotification(data)
+            with self.assertRaises(SignatureError) as cm:
+                decode(parameters, signature)
+            self.assertTrue(cm.exception.args[0].startswith('Bad parameter'))
+
+        @fuzzsettings
+        @given(requests())
+        def test_encodeSignedData_verifiable(self, data):
+            result = encodeSignedData(merchantkey, **dict(data))
+            parameters = result['Ds_MerchantParameters']
+            self.assertEqual(
+                json.loads(base64.b64decode(parameters)),
+                dict(
+                    (key, value[:params[key]['length']])
+                    for key, value in data.items()))
+            self.assertEqual(result['Ds_Signature'], signPayload(
+                orderSecret(merchantkey, data['Ds_Merchant_Order'][:12]),
+                parameters))
+
+        @fuzzsettings
+        @given(requests(), st.data())
+        def test_payloadBuilder_sameAsEncodeSignedData(self, data, draw):
+            candidates = sorted(
+                key for key in data if key != 'Ds_Merchant_Order')
+            merchantFields = draw.draw(st.sets(st.sampled_from(candidates))
+                ) if candidates else set()
+            builder = PayloadBuilder(merchantkey, **dict(
+                (key, data[key]) for key in merchantFields))
+            self.assertEqual(
+                builder.encode(**dict(
+                    (key, value) for key, value in data.items()
+                    if key not in merchantFields)),
+                encodeSignedData(merchantkey, **dict(data)))
+
+
+unittest.TestCase.__str__ = unittest.TestCase.id
+
+if __name__ == '__main__':
+    import sys
+    code = unittest.main()
+    sys.exit(code)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Sermepa profiling
+    ~~~~~~~~~~~~~~~~~
+
+    Opt-in sampling profiler for encodeSignedData and decodeSignedData.
+    A sample of the calls is timed into fixed bucket latency histograms
+    by operation, merchant code and transaction type,
+    which can be dumped as json on demand, through the API or a signal.
+
+    With a zero sample rate, the calls just go through.
+
+"""
+
+import bisect
+import json
+import os
+import random
+import signal
+import threading
+import time
+
+from . import encodeSignedData, decodeSignedData
+
+# Upper bounds, in milliseconds, of the latency buckets.
+# An additional bucket takes the slower calls.
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed bucket bounds in milliseconds.
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'totalMs', 'maxMs')
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.totalMs = 0.
+        self.maxMs = 0.
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.totalMs += ms
+        if ms > self.maxMs:
+            self.maxMs = ms
+
+    def dump(self):
+        return dict(
+            buckets = list(self.bounds),
+            counts = list(self.counts),
+            count = self.count,
+            totalMs = self.totalMs,
+            maxMs = self.maxMs,
+            )
+
+
+class Profiler(object):
+    """
+    Drop-in for encodeSignedData and decodeSignedData timing
+    a `sampleRate` fraction (0 to 1) of the calls.
+    Histograms are kept by operation ('encode' or 'decode'),
+    merchant code and transaction type.
+    When unknown, as for rejected notifications,
+    merchant code and transaction type are '?'.
+    """
+
+    def __init__(self, sampleRate=0., buckets=BUCKETS, random=random.random):
+        self.sampleRate = sampleRate
+        self.buckets = buckets
+        self._random = random
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _sampled(self):
+        return self.sampleRate and self._random() < self.sampleRate
+
+    def _record(self, operation, merchant, transactionType, ms):
+        key = operation, merchant or '?', transactionType or '?'
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.add(ms)
+
+    def encodeSignedData(self, merchantKey, **kwds):
+        if not self._sampled():
+            return encodeSignedData(merchantKey, **kwds)
+        start = _timer()
+        try:
+            return encodeSignedData(merchantKey, **kwds)
+        finally:
+            self._record('encode',
+                kwds.get('Ds_Merchant_MerchantCode'),
+                kwds.get('Ds_Merchant_TransactionType'),
+                (_timer() - start) * 1000)
+
+    def decodeSignedData(self, merchantKey, *args, **kwds):
+        if not self._sampled():
+            return decodeSignedData(merchantKey, *args, **kwds)
+        data = {}
+        start = _timer()
+        try:
+            data = decodeSignedData(merchantKey, *args, **kwds)
+            return data
+        finally:
+            self._record('decode',
+                data.get('Ds_MerchantCode'),
+                data.get('Ds_TransactionType'),
+                (_timer() - start) * 1000)
+
+    def dump(self):
+        """
+        Returns the histograms as a nested dictionary:
+        operation, merchant code and transaction type.
+        """
+        result = {}
+        with self._lock:
+            for (operation, merchant, transactionType), histogram in (
+                    self._histograms.items()):
+                result.setdefault(operation, {}).setdefault(merchant, {})[
+                    transactionType] = histogram.dump()
+        return result
+
+    def dumpJson(self, output):
+        """
+        Writes the histograms as json into `output`,
+        a file name or a file like object.
+        """
+        if not hasattr(output, 'write'):
+            with open(output, 'w') as outputfile:
+                return self.dumpJson(outputfile)
+        json.dump(self.dump(), output, indent=4, sort_keys=True)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def installSignalHandler(self, path, signum=signal.SIGUSR1):
+        """
+        Dumps the histograms as json into the file at `path`
+        whenever the process receives the signal `signum`.
+        """
+        def dump():
+            # Readers never see a half written file
+            self.dumpJson(path + '.tmp')
+            os.rename(path + '.tmp', path)
+
+        def handler(signum, frame):
+            # The interrupted code may hold the lock, dump from elsewhere
+            threading.Thread(target=dump).start()
+        signal.signal(signum, handler)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+from StringIO import StringIO
+from sermepa import encodeSignedData, SignatureError
+from sermepa.profiling import Profiler, Histogram
+
+
+class Histogram_Test(unittest.TestCase):
+
+    def test_add(self):
+        histogram = Histogram((1, 10))
+        for ms in 0.5, 1, 5, 10, 50, 60:
+            histogram.add(ms)
+        self.assertEqual(histogram.dump(), dict(
+            buckets = [1, 10],
+            counts = [2, 2, 2],
+            count = 6,
+            totalMs = 126.5,
+            maxMs = 60,
+            ))
+
+
+class Profiler_Test(unittest.TestCase):
+
+    merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+    encodeddata = b'eyJEc19PcmRlciI6ICI2NjYifQ=='
+    signature = b"BskiXgq875tls56oClRVg72-ppcLpOSW0JUY9riQEKs="
+    signatureversion = 'HMAC_SHA256_V1'
+    data = dict(
+        Ds_Merchant_MerchantCode = '123456789',
+        Ds_Merchant_Order = '1447961844',
+        Ds_Merchant_Amount = '10000',
+        Ds_Merchant_TransactionType = '0',
+        )
+
+    def counts(self, profiler, operation, merchant, transactionType):
+        histogram = profiler.dump()[operation][merchant][transactionType]
+        return histogram['count']
+
+    def test_encodeSignedData_sameResult(self):
+        profiler = Profiler(sampleRate=1)
+        self.assertEqual(
+            profiler.encodeSignedData(self.merchantkey, **self.data),
+            encodeSignedData(self.merchantkey, **self.data))
+
+    def test_encodeSignedData_sampled(self):
+        profiler = Profiler(sampleRate=1)
+        profiler.encodeSignedData(self.merchantkey, **self.data)
+        profiler.encodeSignedData(self.merchantkey, **self.data)
+        self.assertEqual(self.counts(profiler, 'encode', '123456789', '0'), 2)
+
+    def test_encodeSignedData_notSampled(self):
+        profiler = Profiler(sampleRate=0)
+        profiler.encodeSignedData(self.merchantkey, **self.data)
+        self.assertEqual(profiler.dump(), {})
+
+    def test_encodeSignedData_partialSampling(self):
+        draws = iter([.1, .6, .2, .9])
+        profiler = Profiler(sampleRate=.5, random=lambda: next(draws))
+        for i in range(4):
+            profiler.encodeSignedData(self.merchantkey, **self.data)
+        self.assertEqual(self.counts(profiler, 'encode', '123456789', '0'), 2)
+
+    def test_encodeSignedData_error(self):
+        profiler = Profiler(sampleRate=1)
+        with self.assertRaises(ValueError):
+            profiler.encodeSignedData(self.merchantkey, BadData='value', **self.data)
+        self.assertEqual(self.counts(profiler, 'encode', '123456789', '0'), 1)
+
+    def test_decodeSignedData(self):
+        profiler = Profiler(sampleRate=1)
+        data = profiler.decodeSignedData(
+            self.merchantkey,
+            Ds_MerchantParameters = self.encodeddata,
+            Ds_Signature = self.signature,
+            Ds_SignatureVersion = self.signatureversion,
+            )
+        self.assertEqual(data, dict(Ds_Order = '666'))
+        self.assertEqual(self.counts(profiler, 'decode', '?', '?'), 1)
+
+    def test_decodeSignedData_error(self):
+        profiler = Profiler(sampleRate=1)
+        with self.assertRaises(SignatureError):
+            profiler.decodeSignedData(
+                self.merchantkey,
+                self.encodeddata,
+                self.signature,
+                'bad',
+                )
+        self.assertEqual(self.counts(profiler, 'decode', '?', '?'), 1)
+
+    def test_dumpJson(self):
+        profiler = Profiler(sampleRate=1)
+        profiler.encodeSignedData(self.merchantkey, **self.data)
+        output = StringIO()
+        profiler.dumpJson(output)
+        self.assertEqual(json.loads(output.getvalue()), profiler.dump())
+
+    def test_reset(self):
+        profiler = Profiler(sampleRate=1)
+        profiler.encodeSignedData(self.merchantkey, **self.data)
+        profiler.reset()
+        self.assertEqual(profiler.dump(), {})
+
+    def test_installSignalHandler(self):
+        directory = tempfile.mkdtemp()
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            path = os.path.join(directory, 'profile.json')
+            profiler = Profiler(sampleRate=1)
+            profiler.encodeSignedData(self.merchantkey, **self.data)
+            profiler.installSignalHandler(path)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            for i in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            with open(path) as dumped:
+                self.assertEqual(json.load(dumped), profiler.dump())
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+            shutil.rmtree(directory)
+
+
+unittest.TestCase.__str__ = unittest.TestCase.id
+
+if __name__ == '__main__':
+    import sys
+    code = unittest.main()
+    sys.exit(code)
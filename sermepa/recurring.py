@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Sermepa recurring payments
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Expands recurring payment schedules into signed requests:
+    an initial recurring transaction (type 5, or R if deferred)
+    carrying Ds_Merchant_DateFrecuency, Ds_Merchant_ChargeExpiryDate
+    and Ds_Merchant_SumTotal,
+    followed by successive transactions (type 6, or S if deferred).
+
+    Schedules are expanded lazily and streamed in date order,
+    so billing many customers just keeps one pending unsigned request
+    for each schedule in memory. Requests are signed as they are
+    yielded, reusing the recently signed successive charges.
+
+"""
+
+import datetime
+import heapq
+
+from . import params
+from .cache import LRUCache
+
+# (initial, successive) transaction types
+RECURRING = ('5', '6')
+DEFERRED = ('R', 'S')
+
+
+def _isodate(date):
+    return date.strftime('%Y-%m-%d')
+
+
+class RecurringSchedule(object):
+    """
+    A recurring payment for `order` of `amount` cents,
+    first charged on `start` and then every `frequency` days
+    until `expiry`, both dates included.
+    """
+
+    def __init__(self, order, amount, start, frequency, expiry, deferred=False):
+        if int(frequency) <= 0:
+            raise ValueError(u"The frequency should be a positive number of days")
+        if expiry < start:
+            raise ValueError(u"The expiry date is previous to the start date")
+        if len(order) > params['Ds_Merchant_Order']['length']:
+            raise ValueError(u"The order %s is longer than %s characters"
+                % (order, params['Ds_Merchant_Order']['length']))
+        self.order = order
+        self.amount = str(amount)
+        self.start = start
+        self.frequency = int(frequency)
+        self.expiry = expiry
+        self.initialType, self.successiveType = (
+            DEFERRED if deferred else RECURRING)
+
+    def dates(self, since=None, until=None):
+        """
+        Yields the charge dates, optionally limited to
+        those between `since` and `until`, both included.
+        """
+        step = datetime.timedelta(days=self.frequency)
+        date = self.start
+        if since is not None and since > date:
+            skipped = -(-(since - date).days // self.frequency)
+            date += step * skipped
+        last = self.expiry if until is None else min(until, self.expiry)
+        while date <= last:
+            yield date
+            date += step
+
+    def charges(self):
+        "Number of charges from start to expiry"
+        return (self.expiry - self.start).days // self.frequency + 1
+
+    def initialParameters(self):
+        return dict(
+            Ds_Merchant_Order = self.order,
+            Ds_Merchant_Amount = self.amount,
+            Ds_Merchant_SumTotal = str(int(self.amount) * self.charges()),
+            Ds_Merchant_TransactionType = self.initialType,
+            Ds_Merchant_DateFrecuency = str(self.frequency),
+            Ds_Merchant_ChargeExpiryDate = _isodate(self.expiry),
+            )
+
+    def successiveParameters(self):
+        return dict(
+            Ds_Merchant_Order = self.order,
+            Ds_Merchant_Amount = self.amount,
+            Ds_Merchant_TransactionType = self.successiveType,
+            )
+
+    def requests(self, since=None, until=None):
+        """
+        Yields (date, parameters) for every charge.
+        """
+        for date in self.dates(since, until):
+            if date == self.start:
+                yield date, self.initialParameters()
+            else:
+                yield date, self.successiveParameters()
+
+
+def _tagged(index, order, stream):
+    # The index breaks ties between equal dates
+    # so that the payloads are never compared
+    for date, payload in stream:
+        yield date, index, order, payload
+
+def _merge(streams):
+    return (
+        (date, order, payload)
+        for date, index, order, payload in heapq.merge(*[
+            _tagged(index, order, stream)
+            for index, order, stream in streams
+            ])
+        )
+
+def scheduleRequests(schedules, since=None, until=None):
+    """
+    Streams (date, order, parameters) for the charges
+    of all the schedules in date order.
+    """
+    return _merge(
+        (index, schedule.order, schedule.requests(since, until))
+        for index, schedule in enumerate(schedules))
+
+def signSchedules(builder, schedules, since=None, until=None, cacheSize=1024):
+    """
+    Streams (date, order, formdata) for the charges
+    of all the schedules in date order, signed with `builder`,
+    a PayloadBuilder holding the merchant fields.
+    Each charge is signed when it is yielded. The successive charges
+    of the last `cacheSize` schedules are kept signed for reuse.
+    """
+    successive = LRUCache(maxsize=cacheSize)
+    for date, order, parameters in scheduleRequests(schedules, since, until):
+        if parameters['Ds_Merchant_TransactionType'] not in (
+                RECURRING[1], DEFERRED[1]):
+            yield date, order, builder.encode(**parameters)
+            continue
+        key = tuple(sorted(parameters.items()))
+        formdata = successive.get(key)
+        if formdata is None:
+            formdata = builder.encode(**parameters)
+            successive.set(key, formdata)
+        yield date, order, dict(formdata)
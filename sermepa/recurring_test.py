@@ -0,0 +1,273 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import base64
+import itertools
+import json
+from datetime import date
+from sermepa import PayloadBuilder, encodeSignedData, Client
+from sermepa.recurring import (
+    RecurringSchedule,
+    scheduleRequests,
+    signSchedules,
+    )
+
+
+class RecurringSchedule_Test(unittest.TestCase):
+
+    merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+    merchant = dict(
+        Ds_Merchant_MerchantCode = '123456789',
+        Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+        Ds_Merchant_Terminal = '1',
+        Ds_Merchant_Currency = '978',
+        )
+
+    def schedule(self, **kwds):
+        params = dict(
+            order = '2016000001',
+            amount = 1000,
+            start = date(2016,1,1),
+            frequency = 30,
+            expiry = date(2016,4,1),
+            )
+        params.update(kwds)
+        return RecurringSchedule(**params)
+
+    def test_dates(self):
+        self.assertEqual(list(self.schedule().dates()), [
+            date(2016,1,1),
+            date(2016,1,31),
+            date(2016,3,1),
+            date(2016,3,31),
+            ])
+
+    def test_dates_expiryIncluded(self):
+        self.assertEqual(list(self.schedule(expiry=date(2016,3,1)).dates()), [
+            date(2016,1,1),
+            date(2016,1,31),
+            date(2016,3,1),
+            ])
+
+    def test_dates_since(self):
+        self.assertEqual(list(self.schedule().dates(since=date(2016,2,1))), [
+            date(2016,3,1),
+            date(2016,3,31),
+            ])
+
+    def test_dates_sinceChargeDate(self):
+        self.assertEqual(list(self.schedule().dates(since=date(2016,3,1))), [
+            date(2016,3,1),
+            date(2016,3,31),
+            ])
+
+    def test_dates_until(self):
+        self.assertEqual(list(self.schedule().dates(until=date(2016,3,1))), [
+            date(2016,1,1),
+            date(2016,1,31),
+            date(2016,3,1),
+            ])
+
+    def test_badFrequency(self):
+        with self.assertRaises(ValueError):
+            self.schedule(frequency=0)
+
+    def test_expiryBeforeStart(self):
+        with self.assertRaises(ValueError):
+            self.schedule(expiry=date(2015,12,31))
+
+    def test_orderTooLong(self):
+        with self.assertRaises(ValueError) as cm:
+            self.schedule(order='2016000001234')
+        self.assertEqual(cm.exception.args[0],
+            u"The order 2016000001234 is longer than 12 characters")
+
+    def test_charges(self):
+        self.assertEqual(self.schedule().charges(), 4)
+        self.assertEqual(self.schedule(expiry=date(2016,1,1)).charges(), 1)
+        self.assertEqual(self.schedule(expiry=date(2016,3,30)).charges(), 3)
+
+    def test_initialParameters_sumTotal(self):
+        self.assertEqual(
+            self.schedule().initialParameters()['Ds_Merchant_SumTotal'],
+            '4000')
+
+    def test_requests(self):
+        requests = list(self.schedule(expiry=date(2016,2,1)).requests())
+        self.assertEqual(requests, [
+            (date(2016,1,1), dict(
+                Ds_Merchant_Order = '2016000001',
+                Ds_Merchant_Amount = '1000',
+                Ds_Merchant_SumTotal = '2000',
+                Ds_Merchant_TransactionType = '5',
+                Ds_Merchant_DateFrecuency = '30',
+                Ds_Merchant_ChargeExpiryDate = '2016-02-01',
+                )),
+            (date(2016,1,31), dict(
+                Ds_Merchant_Order = '2016000001',
+                Ds_Merchant_Amount = '1000',
+                Ds_Merchant_TransactionType = '6',
+                )),
+            ])
+
+    def test_requests_deferred(self):
+        requests = list(self.schedule(deferred=True).requests())
+        self.assertEqual(
+            [params['Ds_Merchant_TransactionType'] for day, params in requests],
+            ['R', 'S', 'S', 'S'])
+
+    def test_scheduleRequests_inDateOrder(self):
+        schedules = [
+            self.schedule(order='A', start=date(2016,1,10), frequency=10),
+            self.schedule(order='B', start=date(2016,1,1), frequency=15),
+            self.schedule(order='C', start=date(2016,1,10), frequency=20,
+                expiry=date(2016,1,31)),
+            ]
+        requests = scheduleRequests(schedules, until=date(2016,1,31))
+        self.assertEqual(
+            [(day, order) for day, order, params in requests], [
+                (date(2016,1,1), 'B'),
+                (date(2016,1,10), 'A'),
+                (date(2016,1,10), 'C'),
+                (date(2016,1,16), 'B'),
+                (date(2016,1,20), 'A'),
+                (date(2016,1,30), 'A'),
+                (date(2016,1,30), 'C'),
+                (date(2016,1,31), 'B'),
+            ])
+
+    def test_scheduleRequests_expandedLazily(self):
+        schedules = [
+            self.schedule(order=str(i), frequency=1, expiry=date(9999,1,1))
+            for i in range(3)]
+        requests = scheduleRequests(schedules)
+        self.assertEqual(
+            [(day, order) for day, order, params in itertools.islice(requests, 4)], [
+                (date(2016,1,1), '0'),
+                (date(2016,1,1), '1'),
+                (date(2016,1,1), '2'),
+                (date(2016,1,2), '0'),
+            ])
+
+    def test_signSchedules(self):
+        builder = PayloadBuilder(self.merchantkey, **self.merchant)
+        schedules = [
+            self.schedule(order='2016000001', start=date(2016,1,10)),
+            self.schedule(order='2016000002', start=date(2016,1,1)),
+            ]
+        signed = list(signSchedules(builder, schedules))
+        unsigned = list(scheduleRequests(schedules))
+        self.assertEqual(
+            [(day, order) for day, order, formdata in signed],
+            [(day, order) for day, order, params in unsigned])
+        for (day, order, formdata), (_, _, params) in zip(signed, unsigned):
+            self.assertEqual(formdata, encodeSignedData(
+                self.merchantkey, **dict(self.merchant, **params)))
+
+    def countingBuilder(self):
+        builder = PayloadBuilder(self.merchantkey, **self.merchant)
+        encode = builder.encode
+        builder.encoded = 0
+        def countingEncode(**kwds):
+            builder.encoded += 1
+            return encode(**kwds)
+        builder.encode = countingEncode
+        return builder
+
+    def test_signSchedules_signsWhenYielded(self):
+        builder = self.countingBuilder()
+        schedules = [
+            self.schedule(order=str(1000+i), start=date(2016,1,1+i))
+            for i in range(20)]
+        signed = signSchedules(builder, schedules)
+        next(signed)
+        self.assertEqual(builder.encoded, 1)
+
+    def test_signSchedules_successiveSignedOnce(self):
+        builder = self.countingBuilder()
+        schedules = [
+            self.schedule(order='2016000001', start=date(2016,1,10)),
+            self.schedule(order='2016000002', start=date(2016,1,1)),
+            ]
+        signed = list(signSchedules(builder, schedules))
+        self.assertTrue(len(signed) > 4)
+        self.assertEqual(builder.encoded, 4)
+
+    def test_signSchedules_boundedCache(self):
+        builder = self.countingBuilder()
+        schedules = [
+            self.schedule(order='2016000001', start=date(2016,1,10)),
+            self.schedule(order='2016000002', start=date(2016,1,1)),
+            ]
+        unsigned = list(scheduleRequests(schedules))
+        signed = list(signSchedules(builder, schedules, cacheSize=1))
+        # Alternating schedules evict each other successive charge
+        self.assertEqual(builder.encoded, len(unsigned))
+        for (day, order, formdata), (_, _, params) in zip(signed, unsigned):
+            self.assertEqual(formdata, encodeSignedData(
+                self.merchantkey, **dict(self.merchant, **params)))
+
+
+class ClientRecurring_Test(unittest.TestCase):
+
+    merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+    transaction = dict(
+        Ds_Merchant_Order = '1447961844',
+        Ds_Merchant_Amount = 100,
+        Ds_Merchant_SumTotal = 100,
+        Ds_Merchant_ProductDescription = 'the_name_of_the_product',
+        Ds_Merchant_Titular = 'the_owner_of_the_account',
+        Ds_Merchant_MerchantName = 'the_merchant_name',
+        Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+        Ds_Merchant_UrlOK = 'the_url_for_success',
+        Ds_Merchant_UrlKO = 'the_url_for_failure',
+        Ds_Merchant_ConsumerLanguage = '001',
+        Ds_Merchant_MerchantData = 'COBRAMENT QUOTA SOCI',
+        )
+
+    def parameters(self, formdata):
+        return json.loads(base64.b64decode(formdata['Ds_MerchantParameters']))
+
+    def test_get_pay_form_data_notRecurring(self):
+        client = Client('123456789', self.merchantkey)
+        params = self.parameters(client.get_pay_form_data(self.transaction))
+        self.assertNotIn('Ds_Merchant_DateFrecuency', params)
+        self.assertNotIn('Ds_Merchant_ChargeExpiryDate', params)
+
+    def test_get_pay_form_data_recurring(self):
+        client = Client('123456789', self.merchantkey)
+        params = self.parameters(client.get_pay_form_data(dict(
+            self.transaction,
+            Ds_Merchant_TransactionType = '5',
+            Ds_Merchant_DateFrecuency = '30',
+            Ds_Merchant_ChargeExpiryDate = '2016-04-01',
+            )))
+        self.assertEqual(params['Ds_Merchant_TransactionType'], '5')
+        self.assertEqual(params['Ds_Merchant_DateFrecuency'], '30')
+        self.assertEqual(params['Ds_Merchant_ChargeExpiryDate'], '2016-04-01')
+
+    def test_get_pay_form_data_plainAfterRecurring(self):
+        client = Client('123456789', self.merchantkey)
+        client.get_pay_form_data(dict(
+            self.transaction,
+            Ds_Merchant_TransactionType = '5',
+            Ds_Merchant_DateFrecuency = '30',
+            Ds_Merchant_ChargeExpiryDate = '2016-04-01',
+            ))
+        params = self.parameters(client.get_pay_form_data(dict(
+            self.transaction,
+            Ds_Merchant_TransactionType = '0',
+            )))
+        self.assertEqual(params['Ds_Merchant_TransactionType'], '0')
+        self.assertNotIn('Ds_Merchant_DateFrecuency', params)
+        self.assertNotIn('Ds_Merchant_ChargeExpiryDate', params)
+
+
+unittest.TestCase.__str__ = unittest.TestCase.id
+
+if __name__ == '__main__':
+    import sys
+    code = unittest.main()
+    sys.exit(code)
@@ -6,7 +6,19 @@ import unittest
 import base64
 import json
 import re
+import os
+import shutil
+import tempfile
 from sermepa import orderSecret, signPayload, decodeSignedData, SignatureError, encodeSignedData
+import sermepa
+from sermepa import Client, PayloadSigner, PayloadBuilder
+from sermepa import (
+    UnsupportedVersionError,
+    PayloadTooLargeError,
+    MalformedPayloadError,
+    MalformedSignatureError,
+    )
+from sermepa.cache import LRUCache, SqliteCache
 
 try:
     import config
@@ -61,6 +73,25 @@ class Generator_Test(unittest.TestCase):
 
         self.assertMultiLineEqual(signature, self.signature)
 
+    def test_payloadSigner(self):
+        signer = PayloadSigner(self.secret)
+        signature = signer.sign(self.encodedPayload)
+
+        self.assertMultiLineEqual(signature, self.signature)
+
+    def test_payloadSigner_reused(self):
+        signer = PayloadSigner(self.secret)
+        signer.sign(b'another payload')
+        signature = signer.sign(self.encodedPayload)
+
+        self.assertMultiLineEqual(signature, self.signature)
+
+    def test_payloadSigner_forOrder(self):
+        signer = PayloadSigner.forOrder(self.merchantkey, self.merchantOrder)
+        signature = signer.sign(self.encodedPayload)
+
+        self.assertMultiLineEqual(signature, self.signature)
+
 class GeneratorFull_Test(Generator_Test):
 
     data = dict(
@@ -142,6 +173,85 @@ class GeneratorFull_Test(Generator_Test):
         self.assertEqual(len(revertedDescription), 125)
 
 
+    merchantFields = [
+        'Ds_Merchant_MerchantCode',
+        'Ds_Merchant_MerchantName',
+        'Ds_Merchant_MerchantURL',
+        'Ds_Merchant_UrlOK',
+        'Ds_Merchant_UrlKO',
+        'Ds_Merchant_Terminal',
+        'Ds_Merchant_TransactionType',
+        ]
+
+    def payloadBuilder(self):
+        return PayloadBuilder(self.merchantkey, **dict(
+            (key, value)
+            for key, value in self.data.items()
+            if key in self.merchantFields
+            ))
+
+    def orderData(self, **kwds):
+        data = dict(
+            (key, value)
+            for key, value in self.data.items()
+            if key not in self.merchantFields
+            )
+        data.update(kwds)
+        return data
+
+    def test_payloadBuilder_sameAsEncodeSignedData(self):
+        result = self.payloadBuilder().encode(**self.orderData())
+        self.assertEqual(result, dict(
+            Ds_SignatureVersion = 'HMAC_SHA256_V1',
+            Ds_Signature = self.signature,
+            Ds_MerchantParameters =  self.encodedPayload,
+            ))
+
+    def test_payloadBuilder_manyOrders(self):
+        builder = self.payloadBuilder()
+        for order in ['1447961845', '1447961846']:
+            data = self.orderData(Ds_Merchant_Order=order)
+            self.assertEqual(
+                builder.encode(**data),
+                encodeSignedData(self.merchantkey, **dict(self.data, **data)))
+
+    def test_payloadBuilder_noMerchantFields(self):
+        builder = PayloadBuilder(self.merchantkey)
+        self.assertEqual(
+            builder.encodeParameters(**self.data),
+            self.encodedPayload)
+
+    def test_payloadBuilder_valueTooLong(self):
+        builder = self.payloadBuilder()
+        data = self.orderData(
+            Ds_Merchant_ProductDescription = "M"+"0123456789"*300)
+        self.assertEqual(
+            builder.encodeParameters(**data),
+            encodeSignedData(self.merchantkey, **dict(self.data, **data))
+                ['Ds_MerchantParameters'])
+
+    def test_payloadBuilder_orderTooLong(self):
+        builder = self.payloadBuilder()
+        data = self.orderData(Ds_Merchant_Order = '1447961844ABCDEF')
+        self.assertEqual(
+            builder.encode(**data),
+            encodeSignedData(self.merchantkey, **dict(self.data, **data)))
+
+    def test_payloadBuilder_badParam(self):
+        with self.assertRaises(ValueError):
+            self.payloadBuilder().encode(BadData='value', **self.orderData())
+
+    def test_payloadBuilder_merchantParamOverriden(self):
+        with self.assertRaises(ValueError):
+            self.payloadBuilder().encode(
+                Ds_Merchant_Terminal='2', **self.orderData())
+
+    def test_payloadBuilder_noOrder(self):
+        data = self.orderData()
+        del data['Ds_Merchant_Order']
+        with self.assertRaises(KeyError):
+            self.payloadBuilder().encode(**data)
+
     @unittest.skipIf(not config, "Requires a config.py file")
     @unittest.skipIf(config and 'redsystest' not in config.__dict__,
         "redsystest dictionary missing in config.py")
@@ -274,6 +384,103 @@ class GeneratorFull_Test(Generator_Test):
 
 
 
+class Client_Test(unittest.TestCase):
+
+    merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+    transaction = dict(
+        Ds_Merchant_Order = '1447961844',
+        Ds_Merchant_Amount = 100,
+        Ds_Merchant_SumTotal = 100,
+        Ds_Merchant_ProductDescription = 'the_name_of_the_product',
+        Ds_Merchant_Titular = 'the_owner_of_the_account',
+        Ds_Merchant_MerchantName = 'the_merchant_name',
+        Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+        Ds_Merchant_UrlOK = 'the_url_for_success',
+        Ds_Merchant_UrlKO = 'the_url_for_failure',
+        Ds_Merchant_ConsumerLanguage = '001',
+        Ds_Merchant_MerchantData = 'COBRAMENT QUOTA SOCI',
+        )
+
+    def setUp(self):
+        self.encodeSignedData = sermepa.encodeSignedData
+        self.encoded = 0
+        def countingEncode(*args, **kwds):
+            self.encoded += 1
+            return self.encodeSignedData(*args, **kwds)
+        sermepa.encodeSignedData = countingEncode
+
+    def tearDown(self):
+        sermepa.encodeSignedData = self.encodeSignedData
+
+    def formData(self, client, **kwds):
+        transaction = dict(self.transaction, **kwds)
+        return client.get_pay_form_data(transaction)
+
+    def test_get_pay_form_data_withoutCache(self):
+        client = Client('123456789', self.merchantkey)
+        first = self.formData(client)
+        second = self.formData(client)
+        self.assertEqual(first, second)
+        self.assertEqual(self.encoded, 2)
+
+    def test_get_pay_form_data_cachedSameAsUncached(self):
+        uncached = Client('123456789', self.merchantkey)
+        cached = Client('123456789', self.merchantkey, cache=LRUCache())
+        self.assertEqual(self.formData(cached), self.formData(uncached))
+
+    def test_get_pay_form_data_reloadNotSignedAgain(self):
+        client = Client('123456789', self.merchantkey, cache=LRUCache())
+        first = self.formData(client)
+        second = self.formData(client)
+        self.assertEqual(first, second)
+        self.assertEqual(self.encoded, 1)
+
+    def test_get_pay_form_data_modifyingResultKeepsCache(self):
+        client = Client('123456789', self.merchantkey, cache=LRUCache())
+        first = self.formData(client)
+        first['Ds_Signature'] = 'changed'
+        second = self.formData(client)
+        self.assertNotEqual(second['Ds_Signature'], 'changed')
+
+    def test_get_pay_form_data_amountChanged(self):
+        client = Client('123456789', self.merchantkey, cache=LRUCache())
+        first = self.formData(client)
+        second = self.formData(client, Ds_Merchant_Amount = 200)
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.encoded, 2)
+
+    def test_get_pay_form_data_urlChanged(self):
+        client = Client('123456789', self.merchantkey, cache=LRUCache())
+        first = self.formData(client)
+        second = self.formData(client, Ds_Merchant_UrlOK = 'another_url')
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.encoded, 2)
+
+    def test_get_pay_form_data_sharedCacheDifferentKey(self):
+        cache = LRUCache()
+        first = self.formData(Client('123456789', self.merchantkey, cache=cache))
+        second = self.formData(Client('123456789',
+            'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA', cache=cache))
+        self.assertNotEqual(first, second)
+
+    def test_get_pay_form_data_sqliteCache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'cache.sqlite')
+            uncached = self.formData(Client('123456789', self.merchantkey))
+            client = Client('123456789', self.merchantkey,
+                cache=SqliteCache(path))
+            first = self.formData(client)
+            second = self.formData(client)
+            self.assertEqual(first, uncached)
+            self.assertEqual(second, uncached)
+            self.assertEqual(self.encoded, 2)
+            with open(path, 'rb') as cachefile:
+                self.assertNotIn(self.merchantkey, cachefile.read())
+        finally:
+            shutil.rmtree(directory)
+
+
 class NotificationReceiver_Test(unittest.TestCase):
 
     # back2back data taken from PHP example
@@ -308,6 +515,10 @@ class NotificationReceiver_Test(unittest.TestCase):
         signature = signPayload(self.secret, self.encodeddata, urlsafe=True)
         self.assertMultiLineEqual(self.signature, signature)
 
+    def test_payloadSigner_urlsafe(self):
+        signature = PayloadSigner(self.secret).sign(self.encodeddata, urlsafe=True)
+        self.assertMultiLineEqual(self.signature, signature)
+
 
     def test_decodeSignedData_whenAllOk(self):
         data = decodeSignedData(
@@ -393,6 +604,83 @@ class NotificationReceiver_Test(unittest.TestCase):
         msg = cm.exception.args[0]
         self.assertEqual(msg, "Bad parameter 'Bad'")
 
+    def assertDecodeError(self, errorClass, message,
+            parameters=None, signature=None, version=None, **kwds):
+        with self.assertRaises(errorClass) as cm:
+            decodeSignedData(
+                self.merchantkey,
+                Ds_MerchantParameters = parameters or self.encodeddata,
+                Ds_Signature = signature or self.signature,
+                Ds_SignatureVersion = version or self.signatureversion,
+                **kwds)
+        self.assertEqual(cm.exception.args[0], message)
+
+    def test_decodeSignedData_badVersion_specificError(self):
+        self.assertDecodeError(UnsupportedVersionError,
+            'Unsupported signature version',
+            version = 'HMAC_SHA256_V0')
+
+    def test_decodeSignedData_payloadTooLarge(self):
+        self.assertDecodeError(PayloadTooLargeError,
+            'Payload too large',
+            parameters = 'A' * (16*1024+4))
+
+    def test_decodeSignedData_payloadLargerThanConfigured(self):
+        self.assertDecodeError(PayloadTooLargeError,
+            'Payload too large',
+            maxPayloadSize = 10)
+
+    def test_decodeSignedData_payloadNotInBase64Alphabet(self):
+        self.assertDecodeError(MalformedPayloadError,
+            'Unable to decode base 64',
+            parameters = 'eyJEc19PcmRlciI6ICI2NjYifQ==!!!!')
+
+    def test_decodeSignedData_payloadBadPadding(self):
+        self.assertDecodeError(MalformedPayloadError,
+            'Unable to decode base 64',
+            parameters = '3ww')
+
+    def test_decodeSignedData_payloadNotAString(self):
+        self.assertDecodeError(MalformedPayloadError,
+            'Unable to decode base 64',
+            parameters = 1234)
+
+    def test_decodeSignedData_payloadNotAnObject(self):
+        self.assertDecodeError(MalformedPayloadError,
+            'Bad JSON format',
+            parameters = base64.urlsafe_b64encode('["Ds_Order"]'))
+
+    def test_decodeSignedData_orderNotAString(self):
+        for payload in (
+                '{"Ds_Order": 666}',
+                '{"Ds_Order": null}',
+                '{"Ds_Order": ["a"]}',
+                '{"DS_ORDER": {}}',
+                ):
+            self.assertDecodeError(MalformedPayloadError,
+                'Bad Ds_Order attribute',
+                parameters = base64.urlsafe_b64encode(payload))
+
+    def test_decodeSignedData_signatureTooShort(self):
+        self.assertDecodeError(MalformedSignatureError,
+            'Malformed signature',
+            signature = self.signature[:-2])
+
+    def test_decodeSignedData_signatureNotInBase64Alphabet(self):
+        self.assertDecodeError(MalformedSignatureError,
+            'Malformed signature',
+            signature = '*' + self.signature[1:])
+
+    def test_decodeSignedData_badSignatureIsNotMalformed(self):
+        with self.assertRaises(SignatureError) as cm:
+            decodeSignedData(
+                self.merchantkey,
+                Ds_MerchantParameters = base64.urlsafe_b64encode('{"Ds_Order":"777"}'),
+                Ds_Signature = self.signature,
+                Ds_SignatureVersion = self.signatureversion,
+                )
+        self.assertEqual(type(cm.exception), SignatureError)
+
     def test_decodeSignedData_upperCaseOrder(self):
         json_data = '{"DS_ORDER":"666"}'
         base64_data = base64.urlsafe_b64encode(json_data)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Sermepa signing service
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Signing is CPU bound pure Python, so, in a threaded web server,
+    it suffers from the GIL. This service moves the signing
+    to a pool of worker processes which hold the merchant keys,
+    and serves sign/verify requests over a Unix domain socket.
+
+    Run it as:
+
+        python -m sermepa.signingservice --socket /run/sermepa.sock --keys keys.json
+
+    where keys.json maps merchant names to merchant keys.
+    Then use SigningClient as a drop-in for encodeSignedData
+    and decodeSignedData, passing the merchant name instead of the key.
+
+    Every frame is a 4 bytes big endian length followed by
+    a utf-8 json document.
+    Requests: {"op": "encode"|"decode", "merchant": name, "args": {...}}
+    Responses: {"result": ...} or {"error": classname, "message": text}
+    Unexpected failures in the worker come as a ServiceError.
+
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import (
+    encodeSignedData,
+    decodeSignedData,
+    SignatureError,
+    UnsupportedVersionError,
+    PayloadTooLargeError,
+    MalformedPayloadError,
+    MalformedSignatureError,
+    )
+
+_header = struct.Struct('>I')
+MAX_FRAME_SIZE = 1024*1024
+
+
+class ProtocolError(Exception): pass
+
+class ServiceError(Exception): pass
+
+
+_errors = dict(
+    (error.__name__, error)
+    for error in (
+        SignatureError,
+        UnsupportedVersionError,
+        PayloadTooLargeError,
+        MalformedPayloadError,
+        MalformedSignatureError,
+        ValueError,
+        KeyError,
+        ServiceError,
+        )
+    )
+
+
+def _recvExactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def sendFrame(sock, document):
+    payload = json.dumps(document).encode('utf-8')
+    sock.sendall(_header.pack(len(payload)) + payload)
+
+def recvFrame(sock):
+    """
+    Returns the next document received or None
+    if the connection was closed.
+    """
+    header = _recvExactly(sock, _header.size)
+    if header is None:
+        return None
+    size, = _header.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError("Frame too large")
+    payload = _recvExactly(sock, size)
+    if payload is None:
+        raise ProtocolError("Truncated frame")
+    return json.loads(payload.decode('utf-8'))
+
+
+# Worker process side
+
+_merchantKeys = {}
+
+def _initWorker(keys):
+    # The server process handles the interruption
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _merchantKeys.clear()
+    _merchantKeys.update(keys)
+
+def _str(value):
+    # Python 2 json gives unicode, pyDes and hmac want str
+    return value.encode('utf-8') if isinstance(value, type(u'')) else value
+
+def process(request):
+    """
+    Serves a decoded request in a worker process.
+    Returns the response document.
+    """
+    try:
+        op = request['op']
+        merchantKey = _str(_merchantKeys[request['merchant']])
+        args = dict(
+            (str(key), value)
+            for key, value in request['args'].items())
+        if op == 'encode':
+            # Just the order goes into the 3DES, keep texts as unicode
+            if 'Ds_Merchant_Order' in args:
+                args['Ds_Merchant_Order'] = _str(args['Ds_Merchant_Order'])
+            result = encodeSignedData(merchantKey, **args)
+        elif op == 'decode':
+            result = decodeSignedData(merchantKey, **args)
+        else:
+            raise ValueError("Unknown operation '{}'".format(op))
+    except (SignatureError, ValueError, KeyError, TypeError) as e:
+        name = type(e).__name__
+        return dict(
+            error = name if name in _errors else 'ValueError',
+            message = e.args[0] if e.args else '',
+            )
+    except Exception as e:
+        # Never let a bad request kill the connection handler
+        return dict(
+            error = 'ServiceError',
+            message = type(e).__name__,
+            )
+    return dict(result=result)
+
+
+# Server side
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request = recvFrame(self.request)
+            except (ProtocolError, ValueError, socket.error):
+                return
+            if request is None:
+                return
+            response = self.server.pool.apply(process, (request,))
+            sendFrame(self.request, response)
+
+
+class SigningServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves signing requests on the Unix socket at `path`
+    using a pool of `processes` worker processes
+    (as many as cpus by default) holding `keys`,
+    a dictionary from merchant names to merchant keys.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, keys, processes=None):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.pool = multiprocessing.Pool(processes, _initWorker, (keys,))
+        socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+# Client side
+
+class SigningClient(object):
+    """
+    Drop-in for encodeSignedData and decodeSignedData
+    sending the work to a SigningServer listening at `path`.
+    Keeps a connection for each thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'socket', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            self._local.socket = sock
+        return sock
+
+    def close(self):
+        sock = getattr(self._local, 'socket', None)
+        if sock is not None:
+            self._local.socket = None
+            sock.close()
+
+    def _call(self, op, merchant, args):
+        sock = self._connection()
+        try:
+            sendFrame(sock, dict(op=op, merchant=merchant, args=args))
+            response = recvFrame(sock)
+        except Exception:
+            self.close()
+            raise
+        if response is None:
+            self.close()
+            raise ProtocolError("Connection closed by the server")
+        if 'error' in response:
+            raise _errors[response['error']](response['message'])
+        return response['result']
+
+    def encodeSignedData(self, merchant, **kwds):
+        result = self._call('encode', merchant, kwds)
+        return dict((str(key), str(value)) for key, value in result.items())
+
+    def decodeSignedData(self,
+            merchant,
+            Ds_MerchantParameters,
+            Ds_Signature,
+            Ds_SignatureVersion,
+            maxPayloadSize=None,
+            ):
+        def text(value):
+            return value.decode('ascii') if isinstance(value, bytes) else value
+        args = dict(
+            Ds_MerchantParameters = text(Ds_MerchantParameters),
+            Ds_Signature = text(Ds_Signature),
+            Ds_SignatureVersion = text(Ds_SignatureVersion),
+            )
+        if maxPayloadSize is not None:
+            args['maxPayloadSize'] = maxPayloadSize
+        return self._call('decode', merchant, args)
+
+
+def main(args=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Serves Sermepa signatures from a pool of processes")
+    parser.add_argument('--socket', required=True,
+        help="Unix socket path to listen at")
+    parser.add_argument('--keys', required=True,
+        help="json file mapping merchant names to merchant keys")
+    parser.add_argument('--processes', type=int, default=None,
+        help="Number of worker processes, as many as cpus by default")
+    options = parser.parse_args(args)
+
+    with open(options.keys) as keysfile:
+        keys = json.load(keysfile)
+
+    server = SigningServer(options.socket, keys, options.processes)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
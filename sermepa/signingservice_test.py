@@ -0,0 +1,157 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import base64
+import os
+import shutil
+import tempfile
+import threading
+import socket
+from sermepa import (
+    encodeSignedData,
+    decodeSignedData,
+    SignatureError,
+    PayloadTooLargeError,
+    )
+from sermepa.signingservice import (
+    SigningServer,
+    SigningClient,
+    sendFrame,
+    recvFrame,
+    )
+
+
+class SigningService_Test(unittest.TestCase):
+
+    merchantkey = b'Mk9m98IfEblmPfrpsawt7BmxObt98Jev'
+    encodeddata = b'eyJEc19PcmRlciI6ICI2NjYifQ=='
+    signature = b"BskiXgq875tls56oClRVg72-ppcLpOSW0JUY9riQEKs="
+    signatureversion = 'HMAC_SHA256_V1'
+    data = dict(
+        Ds_Merchant_MerchantCode = '123456789',
+        Ds_Merchant_Order = '1447961844',
+        Ds_Merchant_Amount = '10000',
+        Ds_Merchant_ProductDescription = 'the_name_of_the_product',
+        Ds_Merchant_MerchantURL = 'the_url_to_be_notified_at',
+        Ds_Merchant_Terminal = '1',
+        Ds_Merchant_TransactionType = '0',
+        )
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, 'sermepa.sock')
+        cls.server = SigningServer(cls.path, dict(
+            mymerchant = cls.merchantkey,
+            ), processes=2)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.client = SigningClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_encodeSignedData(self):
+        result = self.client.encodeSignedData('mymerchant', **self.data)
+        self.assertEqual(result,
+            encodeSignedData(self.merchantkey, **self.data))
+
+    def test_encodeSignedData_nonAscii(self):
+        data = dict(self.data,
+            Ds_Merchant_Titular = u'Josep Martí',
+            Ds_Merchant_ProductDescription = u'Factura d\'electricitat',
+            )
+        result = self.client.encodeSignedData('mymerchant', **data)
+        self.assertEqual(result,
+            encodeSignedData(self.merchantkey, **data))
+
+    def test_encodeSignedData_badParam(self):
+        with self.assertRaises(ValueError) as cm:
+            self.client.encodeSignedData('mymerchant', BadData='value')
+        self.assertEqual(cm.exception.args[0],
+            u"The received parameter BadData is not allowed.")
+
+    def test_encodeSignedData_unknownMerchant(self):
+        with self.assertRaises(KeyError) as cm:
+            self.client.encodeSignedData('unknown', **self.data)
+        self.assertEqual(cm.exception.args[0], 'unknown')
+
+    def test_decodeSignedData(self):
+        data = self.client.decodeSignedData('mymerchant',
+            Ds_MerchantParameters = self.encodeddata,
+            Ds_Signature = self.signature,
+            Ds_SignatureVersion = self.signatureversion,
+            )
+        self.assertEqual(data, dict(
+            Ds_Order = '666',
+            ))
+
+    def test_decodeSignedData_badSignature(self):
+        json_data = '{"Ds_Order":"777"}'
+        with self.assertRaises(SignatureError) as cm:
+            self.client.decodeSignedData('mymerchant',
+                Ds_MerchantParameters = base64.urlsafe_b64encode(json_data),
+                Ds_Signature = self.signature,
+                Ds_SignatureVersion = self.signatureversion,
+                )
+        self.assertEqual(cm.exception.args[0], 'Bad signature')
+
+    def test_decodeSignedData_maxPayloadSize(self):
+        with self.assertRaises(PayloadTooLargeError):
+            self.client.decodeSignedData('mymerchant',
+                Ds_MerchantParameters = self.encodeddata,
+                Ds_Signature = self.signature,
+                Ds_SignatureVersion = self.signatureversion,
+                maxPayloadSize = 8,
+                )
+
+    def test_badRequest_connectionKept(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        try:
+            sendFrame(sock, dict(op='encode', merchant='mymerchant', args=[]))
+            self.assertEqual(recvFrame(sock)['error'], 'ServiceError')
+            sendFrame(sock, dict(op='decode', merchant='mymerchant', args=dict(
+                Ds_MerchantParameters = self.encodeddata,
+                Ds_Signature = self.signature,
+                Ds_SignatureVersion = self.signatureversion,
+                )))
+            self.assertEqual(recvFrame(sock), dict(result=dict(Ds_Order='666')))
+        finally:
+            sock.close()
+
+    def test_connectionReusedAfterError(self):
+        with self.assertRaises(SignatureError):
+            self.client.decodeSignedData('mymerchant',
+                Ds_MerchantParameters = self.encodeddata,
+                Ds_Signature = self.signature,
+                Ds_SignatureVersion = 'bad',
+                )
+        data = self.client.decodeSignedData('mymerchant',
+            Ds_MerchantParameters = self.encodeddata,
+            Ds_Signature = self.signature,
+            Ds_SignatureVersion = self.signatureversion,
+            )
+        self.assertEqual(data, dict(
+            Ds_Order = '666',
+            ))
+
+
+unittest.TestCase.__str__ = unittest.TestCase.id
+
+if __name__ == '__main__':
+    import sys
+    code = unittest.main()
+    sys.exit(code)
@@ -28,6 +28,7 @@ setup(
         ],
     test_require=[
         'requests',
+        'hypothesis',
         ],
     packages=find_packages(),
     package_data=PACKAGES_DATA,